@@ -0,0 +1,177 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# Kite interval names and their length in minutes (None for daily candles)
+INTERVAL_MINUTES = {
+    "minute": 1,
+    "3minute": 3,
+    "5minute": 5,
+    "10minute": 10,
+    "15minute": 15,
+    "30minute": 30,
+    "60minute": 60,
+    "day": None,
+}
+
+# NSE opens at 09:15, so intraday candles are anchored at a quarter past
+SESSION_OFFSET = "15min"
+
+ONE_DAY = dt.timedelta(days=1)
+
+AGGREGATION = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "volume": "sum",
+}
+
+
+def derivable(interval, base_interval):
+    """ Tells whether candles of interval can be aggregated from base_interval ones.
+    """
+    base, target = INTERVAL_MINUTES[base_interval], INTERVAL_MINUTES[interval]
+    if interval == base_interval or target is None:
+        return True
+    return base is not None and target % base == 0
+
+
+class BarResampler:
+    """ Derives coarser candles and return statistics from one set of base candles.
+
+    Every resampled frame and return series is computed once and memoized
+    until new base candles arrive through update().
+
+    Attributes
+    ==========
+    bars: pd.DataFrame
+        date-indexed base candles
+    interval: str
+        Kite interval of the base candles
+    ranges: list
+        disjoint (start, end, loaded) date ranges covered by the base candles,
+        with the date on which their last day was loaded
+
+    Methods
+    =======
+    can_serve:
+        tells whether candles of an interval can be derived from the base candles
+
+    covers:
+        tells whether an interval and date range can be served without fetching
+
+    resample:
+        returns OHLCV candles of a coarser Kite interval
+
+    log_returns:
+        returns log returns of the close resampled to a pandas frequency
+
+    update:
+        merges newly arrived base candles and invalidates the memoized results
+    """
+
+    def __init__(self, bars, interval, start=None, end=None, loaded=None):
+        if interval not in INTERVAL_MINUTES:
+            raise ValueError("unknown interval {}".format(interval))
+        self.bars = bars
+        self.interval = interval
+        self.ranges = []
+        self._cover(
+            start if start is not None else self._first_date(),
+            end if end is not None else self._last_date(),
+            loaded,
+        )
+        self._candles = {interval: bars}
+        self._returns = {}
+
+    def __repr__(self):
+        rep = "BarResampler(interval = {}, ranges = {}, bars = {})"
+        return rep.format(self.interval, len(self.ranges), len(self.bars))
+
+    def _first_date(self):
+        return self.bars.index[0].date() if len(self.bars) else None
+
+    def _last_date(self):
+        return self.bars.index[-1].date() if len(self.bars) else None
+
+    def _cover(self, start, end, loaded=None):
+        """ Adds a loaded date range, merged with the ranges it overlaps or touches.
+        """
+        if start is None or end is None:
+            return
+        loaded = loaded if loaded is not None else dt.date.today()
+        ranges = []
+        for r_start, r_end, r_loaded in self.ranges:
+            if r_start > end + ONE_DAY or start > r_end + ONE_DAY:
+                ranges.append((r_start, r_end, r_loaded))
+                continue
+            # the range reaching furthest decides whether its last day is complete
+            if r_end > end or (r_end == end and r_loaded > loaded):
+                end, loaded = r_end, r_loaded
+            start = min(start, r_start)
+        self.ranges = sorted(ranges + [(start, end, loaded)])
+
+    def can_serve(self, interval):
+        """ Tells whether candles of interval can be built from the base candles.
+        """
+        return derivable(interval, self.interval)
+
+    def covers(self, interval, start, end):
+        """ Tells whether interval candles between start and end can be served.
+
+        The last day of a range loaded on or before that day does not count
+        as covered, since its candles may still have been forming.
+        """
+        if not self.can_serve(interval):
+            return False
+        start, end = pd.Timestamp(start).date(), pd.Timestamp(end).date()
+        for r_start, r_end, loaded in self.ranges:
+            last = r_end if r_end < loaded else r_end - ONE_DAY
+            if r_start <= start and end <= last:
+                return True
+        return False
+
+    def resample(self, interval):
+        """ Returns OHLCV candles of a Kite interval derived from the base candles.
+        """
+        if interval not in self._candles:
+            if not self.can_serve(interval):
+                raise ValueError(
+                    "{} candles cannot be built from {} candles".format(
+                        interval, self.interval
+                    )
+                )
+            minutes = INTERVAL_MINUTES[interval]
+            columns = {c: a for c, a in AGGREGATION.items() if c in self.bars.columns}
+            if minutes is None:
+                resampler = self.bars.resample("1D")
+            else:
+                resampler = self.bars.resample(
+                    "{}min".format(minutes), offset=SESSION_OFFSET
+                )
+            candles = resampler.agg(columns).dropna(subset=["close"])
+            candles.index.name = self.bars.index.name
+            self._candles[interval] = candles
+        return self._candles[interval]
+
+    def log_returns(self, freq):
+        """ Returns log returns of the close resampled to a pandas frequency.
+        """
+        if freq not in self._returns:
+            price = self.bars["close"].resample(freq).last()
+            self._returns[freq] = np.log(price / price.shift(1))
+        return self._returns[freq]
+
+    def update(self, bars, start=None, end=None, loaded=None):
+        """ Merges new base candles (newer ones win) and drops memoized results.
+        """
+        if len(bars):
+            merged = pd.concat([self.bars, bars])
+            self.bars = merged[~merged.index.duplicated(keep="last")].sort_index()
+            start = start if start is not None else bars.index[0].date()
+            end = end if end is not None else bars.index[-1].date()
+        self._cover(start, end, loaded)
+        self._candles = {self.interval: self.bars}
+        self._returns = {}
@@ -0,0 +1,270 @@
+import datetime as dt
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+from BarResampler import INTERVAL_MINUTES, SESSION_OFFSET
+
+FIELDS = ["open", "high", "low", "close", "volume"]
+# exchange time zone, candle starts are naive IST times
+IST = dt.timezone(dt.timedelta(hours=5, minutes=30))
+
+
+def exchange_now():
+    """ Returns the current exchange (IST) time as a naive datetime.
+    """
+    return dt.datetime.now(IST).replace(tzinfo=None)
+
+
+class CandleBuilder:
+    """ Aggregates websocket ticks into OHLCV candles per instrument token.
+
+    A candle closes when the first tick of a later candle arrives (or on
+    flush, for instruments that stopped ticking) and on_close is then called
+    with the token and the closed candle. Candles are aligned to the NSE
+    session start like BarResampler's.
+
+    Attributes
+    ==========
+    interval: str
+        candle interval as understood by Kite ("minute", "5minute", ...)
+    on_close: callable
+        on_close(token, candle) with candle a pd.Series named by its start time
+    maxlen: int
+        number of closed candles kept per token
+
+    Methods
+    =======
+    seed:
+        loads historical candles of a token (e.g. from historical_data)
+
+    add_tick:
+        adds one trade price (and the day's cumulative volume) of a token
+
+    on_ticks:
+        KiteTicker on_ticks callback feeding every tick to add_tick
+
+    flush:
+        closes the candles whose interval ended before a given time
+
+    candles:
+        returns the closed candles of a token as a dataframe
+    """
+
+    def __init__(self, interval="5minute", on_close=None, maxlen=1000):
+        minutes = INTERVAL_MINUTES[interval]
+        if minutes is None:
+            raise ValueError("candles are built for intraday intervals only")
+        self.interval = interval
+        self.on_close = on_close
+        self.maxlen = maxlen
+        self._length = pd.Timedelta(minutes=minutes)
+        self._offset = pd.Timedelta(SESSION_OFFSET)
+        self._open = {}
+        self._closed = {}
+        self._last_volume = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "CandleBuilder(interval = {}, tokens = {})".format(
+            self.interval, len(self._closed)
+        )
+
+    def _start(self, timestamp):
+        return (timestamp - self._offset).floor(self._length) + self._offset
+
+    @staticmethod
+    def _local(timestamp):
+        # ticks carry naive exchange (IST) times, historical candles +05:30
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert(IST).tz_localize(None)
+        return timestamp
+
+    def seed(self, token, candles):
+        """ Loads historical candles of a token (date-indexed dataframe with
+        open, high, low, close and volume columns); ticks inside the last of
+        them are dropped.
+        """
+        with self._lock:
+            closed = self._closed.setdefault(token, deque(maxlen=self.maxlen))
+            closed.clear()
+            for start, candle in candles[FIELDS].iterrows():
+                closed.append(pd.Series(candle, name=self._local(start)))
+
+    def add_tick(self, token, timestamp, price, volume_traded=None):
+        """ Adds one tick and returns the candle it closed, if any.
+
+        Parameters
+        ==========
+        token: int
+            instrument token
+        timestamp: datetime
+            exchange time of the tick
+        price: float
+            last traded price
+        volume_traded: int, optional
+            cumulative volume of the day (the "volume_traded" tick field)
+        """
+        start = self._start(self._local(timestamp))
+        closed = None
+        with self._lock:
+            history = self._closed.setdefault(token, deque(maxlen=self.maxlen))
+            if history and start <= history[-1].name:
+                return None
+            candle = self._open.get(token)
+            if candle is not None and start > candle.name:
+                closed = self._close(token)
+                candle = None
+            if volume_traded is None:
+                volume = 0
+            else:
+                # per-candle volume from the day's cumulative volume
+                volume = volume_traded - self._last_volume.get(token, volume_traded)
+                self._last_volume[token] = volume_traded
+            if candle is None:
+                self._open[token] = pd.Series(
+                    [price, price, price, price, volume], index=FIELDS, name=start
+                )
+            else:
+                candle["high"] = max(candle["high"], price)
+                candle["low"] = min(candle["low"], price)
+                candle["close"] = price
+                candle["volume"] += volume
+        if closed is not None and self.on_close is not None:
+            self.on_close(token, closed)
+        return closed
+
+    def _close(self, token):
+        candle = self._open.pop(token)
+        self._closed[token].append(candle)
+        return candle
+
+    def on_ticks(self, ws, ticks):
+        """ KiteTicker on_ticks callback.
+        """
+        for tick in ticks:
+            timestamp = (
+                tick.get("exchange_timestamp")
+                or tick.get("last_trade_time")
+                or exchange_now()
+            )
+            self.add_tick(
+                tick["instrument_token"],
+                timestamp,
+                tick["last_price"],
+                tick.get("volume_traded"),
+            )
+
+    def flush(self, now=None):
+        """ Closes every open candle whose interval ended before now (exchange
+        time, default the current one) and returns them as {token: candle}.
+        """
+        now = self._local(exchange_now() if now is None else now)
+        with self._lock:
+            tokens = [
+                token
+                for token, candle in self._open.items()
+                if candle.name + self._length <= now
+            ]
+            closed = {token: self._close(token) for token in tokens}
+        if self.on_close is not None:
+            for token, candle in closed.items():
+                self.on_close(token, candle)
+        return closed
+
+    def candles(self, token):
+        """ Returns the closed candles of a token as a date-indexed dataframe.
+        """
+        with self._lock:
+            history = list(self._closed.get(token, []))
+        if not history:
+            index = pd.DatetimeIndex([], name="date")
+            return pd.DataFrame(columns=FIELDS, index=index)
+        frame = pd.DataFrame(history)
+        frame.index.name = "date"
+        return frame
+
+
+class ReplayTicker:
+    """ Offline stand-in for KiteTicker feeding recorded ticks to on_ticks.
+
+    Attributes
+    ==========
+    ticks: pd.DataFrame
+        recorded ticks with instrument_token, exchange_timestamp, last_price
+        and (optionally) volume_traded columns, in time order
+    speed: float
+        replay speed relative to the recording (None for as fast as possible)
+    on_ticks, on_connect, on_close: callable
+        callbacks with the KiteTicker signatures
+
+    Methods
+    =======
+    from_csv:
+        loads recorded ticks from a csv file
+
+    subscribe, set_mode:
+        restrict the replay to the subscribed tokens (mode is ignored)
+
+    connect:
+        replays the recording through the callbacks
+    """
+
+    MODE_LTP, MODE_QUOTE, MODE_FULL = "ltp", "quote", "full"
+
+    def __init__(self, ticks, speed=None):
+        self.ticks = ticks
+        self.speed = speed
+        self.on_ticks = None
+        self.on_connect = None
+        self.on_close = None
+        self.tokens = set()
+
+    def __repr__(self):
+        return "ReplayTicker(ticks = {}, speed = {})".format(
+            len(self.ticks), self.speed
+        )
+
+    @classmethod
+    def from_csv(cls, path, speed=None):
+        """ Loads recorded ticks from a csv file.
+        """
+        ticks = pd.read_csv(path, parse_dates=["exchange_timestamp"])
+        return cls(ticks, speed)
+
+    def subscribe(self, tokens):
+        self.tokens.update(tokens)
+
+    def set_mode(self, mode, tokens):
+        self.tokens.update(tokens)
+
+    def connect(self, threaded=False):
+        """ Replays the ticks (in a background thread when threaded).
+        """
+        if threaded:
+            thread = threading.Thread(target=self._replay, daemon=True)
+            thread.start()
+            return thread
+        self._replay()
+
+    def _replay(self):
+        if self.on_connect is not None:
+            self.on_connect(self, None)
+        ticks = self.ticks
+        if self.tokens:
+            ticks = ticks[ticks["instrument_token"].isin(self.tokens)]
+        previous = None
+        for tick in ticks.to_dict("records"):
+            timestamp = tick["exchange_timestamp"]
+            if self.speed and previous is not None:
+                delay = (timestamp - previous).total_seconds() / self.speed
+                if delay > 0:
+                    time.sleep(delay)
+            previous = timestamp
+            if self.on_ticks is not None:
+                self.on_ticks(self, [tick])
+        if self.on_close is not None:
+            self.on_close(self, 1000, "replay finished")
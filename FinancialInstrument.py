@@ -1,47 +1,103 @@
-from kiteconnect import KiteConnect
 import logging
 import os
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from BarResampler import BarResampler, derivable
+from InstrumentIndex import get_index
+from KiteSession import get_kite
+from OHLCVCache import OHLCVCache
+from RateLimiter import RateLimiter
+
+
+# Kite allows 3 historical data requests per second per API key
+HISTORICAL_LIMITER = RateLimiter(3)
+
+
+def plan_windows(from_date, to_date, days=100):
+    """splits [from_date, to_date] into the consecutive windows of at most
+       `days` days in which Kite serves historical data"""
+    if not isinstance(from_date, dt.datetime):
+        from_date = dt.datetime.combine(from_date, dt.time())
+    windows = []
+    while from_date.date() < (to_date - dt.timedelta(days)):
+        windows.append((from_date, from_date + dt.timedelta(days)))
+        from_date = from_date + dt.timedelta(days)
+    windows.append((from_date, to_date))
+    return windows
 
 
 class FinancialInstrument:
     def __init__(
-        self, ticker, start=dt.date.today() - dt.timedelta(30), end=dt.date.today()
+        self,
+        ticker,
+        start=dt.date.today() - dt.timedelta(30),
+        end=dt.date.today(),
+        lazy=False,
     ):
+        """with lazy=True nothing is downloaded until .data or .data_df is
+           first accessed"""
         self._ticker = ticker
         self.start = start
         self.end = end
+        self.lazy = lazy
+        self._data = None
+        self._data_df = None
+        self.interval = None
+        # finest candles loaded so far, coarser intervals are derived from them
+        self.bars = None
+        self._stats = None
         self.get_access()
-        self.get_data()
-        self.log_returns()
+        if not lazy:
+            self.get_data()
+            self.log_returns()
 
     def __repr__(self):
         return "Financial Instrument (ticker = {}, start={}, end = {})".format(
             self._ticker, self.start, self.end
         )
 
+    @property
+    def data(self):
+        if self._data is None:
+            self.get_data()
+            self.log_returns()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._stats = None
+
+    @property
+    def stats(self):
+        """memoized resampled returns of .data, rebuilt whenever .data changes"""
+        if self._stats is None:
+            self._stats = BarResampler(self.data, self.interval or "day")
+        return self._stats
+
+    @property
+    def data_df(self):
+        if self._data_df is None:
+            inception_date = pd.Timestamp(self.start).strftime("%Y-%m-%d")
+            self.get_data_extended(inception_date, "day")
+        return self._data_df
+
+    @data_df.setter
+    def data_df(self, data_df):
+        self._data_df = data_df
+
     def get_access(self):
         cwd = os.path.join(os.getcwd(), "sensitive")
-        instrument_df_loc = os.path.join(cwd, "nse_tickers.csv")
-        access_token = open(os.path.join(cwd, "access_token.txt"), "r").read()
-        key_secret = open(os.path.join(cwd, "api_key.txt"), "r").read().split()
-        kite = KiteConnect(api_key=key_secret[0])
-        kite.set_access_token(access_token)
-        instrument_df = pd.read_csv(instrument_df_loc)
-        self.kite = kite
-        self.instrument_df = instrument_df
+        # one pooled client and one instrument index serve every instrument
+        self.kite = get_kite(cwd)
+        self.instrument_index = get_index(os.path.join(cwd, "nse_tickers.csv"))
 
     def instrumentLookup(self):
         """Looks up instrument token for a given script from instrument dump"""
-        try:
-            return self.instrument_df[
-                self.instrument_df.tradingsymbol == self._ticker
-            ].instrument_token.values[0]
-        except:
-            return -1
+        return self.instrument_index.lookup(self._ticker)
 
     def get_data(self, interval="day"):
         """interval
@@ -55,45 +111,79 @@ class FinancialInstrument:
                 · 30minute
                 · 60minute
                 extracts historical data and outputs in the form of dataframe
+                candles are derived from finer ones already loaded when possible,
+                except a last day that may still have been forming when loaded
                 """
-        instrument = self.instrumentLookup()
-        data = pd.DataFrame(
-            self.kite.historical_data(instrument, self.start, self.end, interval)
-        )
-        data.set_index("date", inplace=True)
+        if self.bars is not None and self.bars.covers(interval, self.start, self.end):
+            data = self.bars.resample(interval)
+            data = data.loc[str(self.start) : str(self.end)].copy()
+        else:
+            instrument = self.instrumentLookup()
+            with HISTORICAL_LIMITER:
+                data = pd.DataFrame(
+                    self.kite.historical_data(
+                        instrument, self.start, self.end, interval
+                    )
+                )
+            data.set_index("date", inplace=True)
+            self._add_bars(data, interval, self.start, self.end)
+        self.interval = interval
         self.data = data
 
-    def get_data_extended(self, inception_date, interval):
+    def get_data_extended(self, inception_date, interval, use_cache=True):
         """extracts historical data and outputs in the form of dataframe
-           inception date string format - yyyy-mm-dd"""
+           inception date string format - yyyy-mm-dd
+           with use_cache, candles already stored under ./cache are reused and
+           only the missing date ranges are requested from Kite"""
         instrument = self.instrumentLookup()
         from_date = dt.datetime.strptime(inception_date, "%Y-%m-%d")
-        to_date = dt.date.today()
-        data = pd.DataFrame(columns=["date", "open", "high", "low", "close", "volume"])
-        while True:
-            if from_date.date() >= (dt.date.today() - dt.timedelta(100)):
-                data = data.append(
-                    pd.DataFrame(
-                        self.kite.historical_data(
-                            instrument, from_date, dt.date.today(), interval
-                        )
-                    ),
-                    ignore_index=True,
-                )
-                break
-            else:
-                to_date = from_date + dt.timedelta(100)
-                data = data.append(
-                    pd.DataFrame(
-                        self.kite.historical_data(
-                            instrument, from_date, to_date, interval
-                        )
-                    ),
-                    ignore_index=True,
+        if use_cache:
+            data = OHLCVCache().update(
+                instrument,
+                interval,
+                from_date.date(),
+                dt.date.today(),
+                lambda start, end: self._fetch_range(instrument, start, end, interval),
+            )
+            # the cache may reach further back than the requested inception
+            data = data.loc[inception_date:]
+        else:
+            data = self._fetch_range(instrument, from_date, dt.date.today(), interval)
+        self._add_bars(data, interval, from_date, dt.date.today())
+        self.data_df = data
+
+    def _add_bars(self, data, interval, start, end):
+        """keeps the finest candles loaded so far for deriving coarser intervals"""
+        start, end = pd.Timestamp(start).date(), pd.Timestamp(end).date()
+        if self.bars is None or (
+            interval != self.bars.interval and derivable(self.bars.interval, interval)
+        ):
+            self.bars = BarResampler(data, interval, start, end)
+        elif interval == self.bars.interval:
+            self.bars.update(data, start, end)
+
+    def _fetch_range(self, instrument, from_date, to_date, interval, max_workers=3):
+        """downloads candles between from_date and to_date in 100 day windows
+           windows are fetched concurrently, limited to the historical API rate"""
+        windows = plan_windows(from_date, to_date)
+
+        def fetch(window):
+            with HISTORICAL_LIMITER:
+                return self.kite.historical_data(
+                    instrument, window[0], window[1], interval
                 )
-                from_date = to_date
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as pool:
+            chunks = [pd.DataFrame(chunk) for chunk in pool.map(fetch, windows)]
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        if not chunks:
+            return pd.DataFrame(
+                columns=["open", "high", "low", "close", "volume"],
+                index=pd.DatetimeIndex([], name="date"),
+            )
+        data = pd.concat(chunks, ignore_index=True)
         data.set_index("date", inplace=True)
-        self.data_df = data
+        return data
 
     def log_returns(self):
         self.data["log_returns"] = np.log(self.data.close / self.data.close.shift(1))
@@ -115,24 +205,25 @@ class FinancialInstrument:
     def set_ticker(self, ticker=None):
         if ticker is not None:
             self._ticker = ticker
-            self.get_data()
-            self.log_returns()
+            self._data = None
+            self._data_df = None
+            self.bars = None
+            self._stats = None
+            if not self.lazy:
+                self.get_data()
+                self.log_returns()
 
     def mean_return(self, freq=None):
         if freq is None:
             return self.data.log_returns.mean()
         else:
-            resampled_price = self.data.close.resample(freq).last()
-            resampled_returns = np.log(resampled_price / resampled_price.shift(1))
-            return resampled_returns.mean()
+            return self.stats.log_returns(freq).mean()
 
     def std_returns(self, freq=None):
         if freq is None:
             return self.data.log_returns.std()
         else:
-            resampled_price = self.data.close.resample(freq).last()
-            resampled_returns = np.log(resampled_price / resampled_price.shift(1))
-            return resampled_returns.std()
+            return self.stats.log_returns(freq).std()
 
     def annualized_perf(self):
         """calculates annualized return and risk
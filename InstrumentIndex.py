@@ -0,0 +1,111 @@
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+
+class InstrumentIndex:
+    """ Hashed symbol -> instrument token index over the Kite instrument dump.
+
+    The dump is parsed once and the resulting dict is pickled next to it, so
+    later processes load the index without touching the csv again until the
+    dump is refreshed. Symbols can be plain ("RELIANCE") or exchange qualified
+    ("NSE:RELIANCE"); like the old boolean scan, the first row of the dump
+    wins when a plain symbol is listed more than once.
+
+    Attributes
+    ==========
+    instrument_df_loc: str
+        path of the instrument dump csv
+
+    Methods
+    =======
+    lookup:
+        returns the instrument token of one symbol (-1 when unknown)
+
+    lookup_many:
+        returns the instrument tokens of many symbols in one call
+    """
+
+    def __init__(self, instrument_df_loc):
+        self.instrument_df_loc = instrument_df_loc
+        self._tokens = self._load()
+
+    def __repr__(self):
+        return "InstrumentIndex(instrument_df_loc = {}, symbols = {})".format(
+            self.instrument_df_loc, len(self._tokens)
+        )
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, symbol):
+        return symbol in self._tokens
+
+    def _load(self):
+        index_loc = os.path.splitext(self.instrument_df_loc)[0] + ".idx.pkl"
+        if os.path.exists(index_loc) and os.path.getmtime(
+            index_loc
+        ) >= os.path.getmtime(self.instrument_df_loc):
+            with open(index_loc, "rb") as f:
+                return pickle.load(f)
+        tokens = self._build(pd.read_csv(self.instrument_df_loc))
+        try:
+            with open(index_loc, "wb") as f:
+                pickle.dump(tokens, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            print("could not persist instrument index to", index_loc)
+        return tokens
+
+    @staticmethod
+    def _build(instrument_df):
+        tokens = {}
+        if "exchange" in instrument_df.columns:
+            qualified = (
+                instrument_df["exchange"].astype(str)
+                + ":"
+                + instrument_df["tradingsymbol"].astype(str)
+            )
+            tokens.update(
+                zip(
+                    qualified[::-1].tolist(),
+                    instrument_df["instrument_token"][::-1].tolist(),
+                )
+            )
+        # reversed so that the first listing of a symbol is the one kept
+        tokens.update(
+            zip(
+                instrument_df["tradingsymbol"][::-1].astype(str).tolist(),
+                instrument_df["instrument_token"][::-1].tolist(),
+            )
+        )
+        return tokens
+
+    def lookup(self, symbol):
+        """ Looks up instrument token for a given script, -1 if not found.
+        """
+        return self._tokens.get(symbol, -1)
+
+    def lookup_many(self, symbols):
+        """ Looks up instrument tokens for a list of scripts, -1 where not found.
+        """
+        tokens = self._tokens
+        return [tokens.get(symbol, -1) for symbol in symbols]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(instrument_df_loc=None):
+    """ Returns the process-wide index for an instrument dump (default
+    sensitive/nse_tickers.csv), building it on first use.
+    """
+    if instrument_df_loc is None:
+        instrument_df_loc = os.path.join(os.getcwd(), "sensitive", "nse_tickers.csv")
+    instrument_df_loc = os.path.abspath(instrument_df_loc)
+    with _indexes_lock:
+        if instrument_df_loc not in _indexes:
+            _indexes[instrument_df_loc] = InstrumentIndex(instrument_df_loc)
+        return _indexes[instrument_df_loc]
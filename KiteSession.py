@@ -0,0 +1,34 @@
+import os
+import threading
+
+from kiteconnect import KiteConnect
+
+# keep-alive connections shared by every thread talking to Kite
+POOL = {"pool_connections": 4, "pool_maxsize": 32, "max_retries": 2}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_kite(credentials_dir=None):
+    """ Returns the process-wide KiteConnect client for the credentials stored
+    in credentials_dir (default ./sensitive).
+
+    The credential files are read and the HTTP session is set up only on the
+    first call, every later caller reuses the same pooled connections.
+    """
+    if credentials_dir is None:
+        credentials_dir = os.path.join(os.getcwd(), "sensitive")
+    credentials_dir = os.path.abspath(credentials_dir)
+    with _sessions_lock:
+        if credentials_dir not in _sessions:
+            access_token = open(
+                os.path.join(credentials_dir, "access_token.txt"), "r"
+            ).read()
+            key_secret = (
+                open(os.path.join(credentials_dir, "api_key.txt"), "r").read().split()
+            )
+            kite = KiteConnect(api_key=key_secret[0], pool=POOL)
+            kite.set_access_token(access_token)
+            _sessions[credentials_dir] = kite
+        return _sessions[credentials_dir]
@@ -1,17 +1,86 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.linear_model import LogisticRegression
+from numpy.lib.stride_tricks import sliding_window_view
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.svm import LinearSVC
 import FinancialInstrument as FI
+from metrics import breakeven_tc, cost_curves
+
+
+def lag_features(returns, lags):
+    """ Returns the (rows x lags - 1) strided view whose row t holds the returns
+    of rows t - 1, ..., t - lags + 1 (NaN before the first return).
+    """
+    n_lags = lags - 1
+    padded = np.concatenate([np.full(n_lags, np.nan), returns])
+    return sliding_window_view(padded, n_lags)[: len(returns), ::-1]
+
+
+def make_model(kind, C, base):
+    """ Returns an unfitted classifier of the given kind with inverse
+    regularization strength C: "logistic" is a clone of the base model (the
+    backtester's configured LogisticRegression), "svm" a LinearSVC.
+    """
+    if kind == "logistic":
+        return clone(base).set_params(C=C)
+    if kind == "svm":
+        return LinearSVC(C=C, max_iter=100000)
+    raise ValueError("unknown model type {}".format(kind))
+
+
+def prediction_metrics(prediction, returns, tc):
+    """ Returns (performance after costs, performance, outperformance, units
+    traded) of trading the predicted signs over the same rows' returns.
+    """
+    strategy = prediction * returns
+    trades = np.abs(np.diff(prediction, prepend=prediction[:1]))
+    perf = np.exp(strategy.sum())
+    perf_actual = np.exp((strategy - trades * tc).sum())
+    outperf = perf_actual - np.exp(returns.sum())
+    return (
+        round(perf_actual, 6),
+        round(perf, 6),
+        round(outperf, 6),
+        int(trades.sum()),
+    )
+
+
+def _sweep_config(features, returns, train, test, lags, C, kind, base, tc):
+    """ Fits one configuration of a sweep and returns its result row.
+    features holds the lags of the largest lags value in the sweep.
+    """
+    X = features[:, : lags - 1]
+    target = np.sign(returns)
+    train = slice(train.start + lags - 1, train.stop)
+    test = slice(test.start + lags - 1, test.stop)
+    model = make_model(kind, C, base).fit(X[train], target[train])
+    in_sample = prediction_metrics(model.predict(X[train]), returns[train], tc)
+    out_of_sample = prediction_metrics(model.predict(X[test]), returns[test], tc)
+    return {
+        "lags": lags,
+        "C": C,
+        "model": kind,
+        "in_sample_perf": in_sample[0],
+        "perf_actual": out_of_sample[0],
+        "perf": out_of_sample[1],
+        "outperf": out_of_sample[2],
+        "trades": out_of_sample[3],
+    }
 
 
 class MLBacktester:
-    def __init__(self, symbol, start, end, tc):
+    def __init__(self, symbol, start, end, tc, model_cache=None):
         self.symbol = symbol
         self.start = start
         self.end = end
         self.tc = tc
+        # optional ModelCache.ModelCache reusing fits of identical training data
+        self.model_cache = model_cache
         self.model = LogisticRegression(C=1e6, max_iter=100000, multi_class="ovr")
+        self.retrain_model = None
         self.results = None
         self.get_data()
 
@@ -22,7 +91,7 @@ class MLBacktester:
         )
 
     def get_data(self):
-        stock = FI.FinancialInstrument(self.symbol)
+        stock = FI.FinancialInstrument(self.symbol, lazy=True)
         stock.get_data_extended("2019-01-01", "day")
         raw = stock.data_df
         raw = raw["close"].to_frame().dropna()
@@ -31,26 +100,46 @@ class MLBacktester:
         raw.rename(columns={self.symbol: "price"}, inplace=True)
         raw["returns"] = np.log(raw.div(raw.shift(1)))
         self.data = raw.dropna()
+        self._lag_matrices = {}
         return raw
 
     def select_data(self, start, end):
         data = self.data.loc[start:end].copy()
         return data
 
+    def lag_matrix(self, lags):
+        """ Returns the (rows x lags - 1) lag features of the whole series: row t
+        holds the returns of rows t - 1, ..., t - lags + 1 (NaN before the first).
+
+        The matrix is a strided view of the returns array, built once per lags.
+        """
+        if lags not in self._lag_matrices:
+            returns = self.data["returns"].to_numpy(dtype=float)
+            self._lag_matrices[lags] = lag_features(returns, lags)
+        return self._lag_matrices[lags]
+
+    def feature_rows(self, start, end):
+        """ Returns the rows between start and end that have all lags within
+        that range (the rows the old per-range shift and dropna kept).
+        """
+        rows = self.data.index.slice_indexer(start, end)
+        return slice(rows.start + self.lags - 1, rows.stop)
+
     def prepare_features(self, start, end):
-        self.data_subset = self.data.loc[start:end].copy()
-        self.feature_columns = []
-        for lag in range(1, self.lags):
-            col = "lag{}".format(lag)
-            self.data_subset[col] = self.data_subset["returns"].shift(lag)
-            self.feature_columns.append(col)
-        self.data_subset.dropna(inplace=True)
+        rows = self.feature_rows(start, end)
+        self.feature_columns = ["lag{}".format(lag) for lag in range(1, self.lags)]
+        self.features = self.lag_matrix(self.lags)[rows]
+        self.data_subset = self.data.iloc[rows].copy()
 
     def fit_model(self, start, end):
         self.prepare_features(start, end)
-        self.model.fit(
-            self.data_subset[self.feature_columns], np.sign(self.data_subset["returns"])
-        )
+        self._fit(self.features, np.sign(self.data_subset["returns"]))
+
+    def _fit(self, features, target):
+        if self.model_cache is None:
+            self.model.fit(features, target)
+        else:
+            self.model = self.model_cache.fit(self.model, features, target)
 
     def test_strategy(self, start_train, end_train, start_test, end_test, lags=5):
         self.lags = lags
@@ -59,8 +148,14 @@ class MLBacktester:
 
         self.prepare_features(start_test, end_test)
 
-        prediction = self.model.predict(self.data_subset[self.feature_columns])
+        prediction = self.model.predict(self.features)
+        return self._backtest(prediction)
 
+    def _backtest(self, prediction):
+        """ Builds the results dataframe of trading the predictions on
+        data_subset and returns (performance after costs, performance,
+        outperformance).
+        """
         self.data_subset["pred"] = prediction
 
         self.data_subset["strategy"] = (
@@ -94,6 +189,190 @@ class MLBacktester:
 
         return round(perf_actual, 6), round(perf, 6), round(outperf, 6)
 
+    def rolling_retrain(self, start, end, train, step=1, lags=5, online=False):
+        """ Walk-forward backtest between start and end: the model is retrained
+        on the `train` rows before every block of `step` rows and predicts
+        that block, giving one out-of-sample prediction series in one run.
+
+        Each retrain warm-starts from the previous coefficients, so it only
+        needs a few solver iterations. With online=True an SGD logistic
+        regression instead learns incrementally (partial_fit) from the rows
+        that entered the window since the last step, so every step costs
+        O(step) rather than O(train). That is an expanding fit: rows leaving
+        the window are never forgotten, only outweighed by newer ones.
+
+        The last retrained model is kept in retrain_model; the model fitted
+        by fit_model is left untouched.
+
+        Parameters
+        ==========
+        start, end: str
+            out-of-sample period
+        train: int
+            number of rows in the training window
+        step: int
+            number of rows predicted between retrains
+        lags: int
+            number of lags + 1 used as features
+        online: bool
+            learn incrementally with SGDClassifier(loss="log_loss") over an
+            expanding window instead of refitting on the last `train` rows
+
+        Returns
+        =======
+        perf_actual, perf, outperf: as test_strategy, with the predictions
+        in results["pred"]
+        """
+        self.lags = lags
+        features = self.lag_matrix(lags)
+        target = np.sign(self.data["returns"].to_numpy(dtype=float))
+        rows = self.data.index.slice_indexer(start, end)
+        # the first training window needs all of its lags
+        first = max(rows.start, lags - 1 + train)
+        stop = rows.stop
+        if first >= stop:
+            raise ValueError("not enough data before the out-of-sample period")
+
+        if online:
+            model = SGDClassifier(loss="log_loss", random_state=0)
+            classes = np.unique(target[lags - 1 : stop])
+        else:
+            model = clone(self.model).set_params(warm_start=True)
+        prediction = np.empty(stop - first)
+        for t in range(first, stop, step):
+            if online:
+                new = slice(t - train if t == first else t - step, t)
+                model.partial_fit(features[new], target[new], classes=classes)
+            else:
+                model.fit(features[t - train : t], target[t - train : t])
+            block = slice(t, min(t + step, stop))
+            prediction[block.start - first : block.stop - first] = model.predict(
+                features[block]
+            )
+        self.retrain_model = model
+        self.data_subset = self.data.iloc[first:stop].copy()
+        return self._backtest(prediction)
+
+    def evaluate(self, start_train, end_train, start_test, end_test, lags=5):
+        """ Same backtest as test_strategy, returning (performance after costs,
+        performance, outperformance, units traded) computed on numpy arrays
+        without building the results dataframe.
+
+        Features and returns are sliced from the whole-series arrays, so neither
+        data_subset nor features is touched.
+        """
+        self.lags = lags
+        returns = self.data["returns"].to_numpy(dtype=float)
+        features = self.lag_matrix(lags)
+        train = self.feature_rows(start_train, end_train)
+        self._fit(features[train], np.sign(returns[train]))
+        test = self.feature_rows(start_test, end_test)
+        prediction = self.model.predict(features[test])
+        return prediction_metrics(prediction, returns[test], self.tc)
+
+    def tc_sensitivity(
+        self, start_train, end_train, start_test, end_test, tcs, lags=5
+    ):
+        """ Runs the test_strategy backtest for many transaction cost levels in
+        one pass (the predictions and trades do not depend on tc).
+
+        Parameters
+        ==========
+        start_train, end_train, start_test, end_test: str
+            train and test periods
+        tcs: array-like
+            proportional transaction costs per trade
+        lags: int
+            number of lags + 1 used as features
+
+        Returns
+        =======
+        performance: pd.DataFrame
+            perf_actual and outperf per cost level
+        equity: pd.DataFrame
+            (time x cost level) cumulative net performance
+        breakeven: pd.Series
+            costs at which the strategy breaks even and matches buy and hold
+        """
+        self.lags = lags
+        self.fit_model(start_train, end_train)
+        self.prepare_features(start_test, end_test)
+        prediction = self.model.predict(self.features)
+        returns = self.data_subset["returns"].to_numpy(dtype=float)
+        strategy = prediction * returns
+        trades = np.abs(np.diff(prediction, prepend=prediction[:1]))
+        tcs = np.asarray(tcs, dtype=float)
+        equity = np.exp(cost_curves(strategy, trades, tcs))
+        buy_and_hold = returns.sum()
+        performance = pd.DataFrame(
+            {
+                "perf_actual": equity[-1],
+                "outperf": equity[-1] - np.exp(buy_and_hold),
+            },
+            index=pd.Index(tcs, name="tc"),
+        ).round(6)
+        breakeven = pd.Series(
+            {
+                "zero": breakeven_tc(strategy, trades),
+                "buy_and_hold": breakeven_tc(strategy, trades, buy_and_hold),
+            }
+        )
+        equity = pd.DataFrame(equity, index=self.data_subset.index, columns=tcs)
+        return performance, equity, breakeven
+
+    def sweep(
+        self,
+        start_train,
+        end_train,
+        start_test,
+        end_test,
+        lags_values,
+        C_values=(1e6,),
+        models=("logistic",),
+        n_jobs=-1,
+    ):
+        """ Evaluates every (lags, C, model) configuration in parallel.
+
+        All configurations share one lag matrix built for the largest lags
+        value; each one uses its first lags - 1 columns over the rows
+        test_strategy would use. Logistic configurations are clones of
+        self.model with only C changed.
+
+        Parameters
+        ==========
+        start_train, end_train, start_test, end_test: str
+            train and test periods
+        lags_values: iterable
+            lags values to try
+        C_values: iterable
+            inverse regularization strengths to try
+        models: iterable
+            model types to try ("logistic", "svm")
+        n_jobs: int
+            number of joblib workers (-1 for all cores)
+
+        Returns
+        =======
+        pd.DataFrame
+            one row per configuration with the in-sample performance after
+            costs and the out-of-sample perf_actual, perf, outperf and trades
+        """
+        configs = [
+            (lags, C, kind) for lags in lags_values for C in C_values for kind in models
+        ]
+        returns = self.data["returns"].to_numpy(dtype=float)
+        # one contiguous copy, memory-mapped into the workers by joblib
+        features = np.ascontiguousarray(lag_features(returns, max(lags_values)))
+        train = self.data.index.slice_indexer(start_train, end_train)
+        test = self.data.index.slice_indexer(start_test, end_test)
+        rows = Parallel(n_jobs=n_jobs)(
+            delayed(_sweep_config)(
+                features, returns, train, test, lags, C, kind, self.model, self.tc
+            )
+            for lags, C, kind in configs
+        )
+        return pd.DataFrame(rows)
+
     def plot_results(self):
         """ Plots the cumulative performance of the trading strategy
         compared to buy and hold.
@@ -1,13 +1,128 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import brute
 import FinancialInstrument as FI
 import os
+from metrics import (
+    breakeven_tc,
+    cost_curves,
+    kept_rows,
+    strategy_metrics,
+    strategy_returns,
+)
+from optimizers import get_optimizer
+from rolling_stats import RollingStats
+from ResultCache import fingerprint, get_result_cache
+import walk_forward as wf
 
 plt.style.use("seaborn")
 
 
+def meanrev_positions(price, sma, lower, upper, start=None):
+    """ Positions of the mean reversion strategy along the last axis.
+
+    Long below the lower band, short above the upper band, flat when the
+    price crosses the SMA and unchanged otherwise (flat before any signal).
+    Rows without a price or SMA are skipped as by dropna: they give no
+    signal and a crossing compares with the last row that had a distance.
+    A given start is held on the first row instead of its own signal.
+    """
+    distance = price - sma
+    position = np.where(price < lower, 1.0, np.nan)
+    position = np.where(price > upper, -1.0, position)
+    previous = _ffill(distance)
+    crossed = np.zeros(position.shape, dtype=bool)
+    crossed[..., 1:] = distance[..., 1:] * previous[..., :-1] < 0
+    position = np.where(crossed, 0.0, position)
+    if start is not None:
+        position[..., 0] = start
+    return np.nan_to_num(_ffill(position))
+
+
+def _ffill(values):
+    # forward fill: index of the last non-NaN value at or before every row
+    last = np.where(np.isnan(values), 0, np.arange(values.shape[-1]))
+    np.maximum.accumulate(last, axis=-1, out=last)
+    return np.take_along_axis(values, last, axis=-1)
+
+
+def meanrev_batch(prices, SMA, dev, tc=0.0):
+    """ Backtests the mean reversion strategy on every column of a
+    (time x symbol) price matrix at once, e.g. Universe.field("close").
+
+    Each symbol starts at its own first row with a price, return, SMA and
+    standard deviation (as test_strategy after dropna), so symbols listed
+    later than others are handled. Later rows missing any of them are
+    skipped like test_strategy's dropna skips them on the same column: they
+    give no signal, the position carries over them and neither the strategy
+    nor buy and hold earns their returns.
+
+    Parameters
+    ==========
+    prices: pd.DataFrame
+        (time x symbol) prices
+    SMA: int
+        time window for SMA
+    dev: float
+        distance for Lower/Upper Bands in Standard Deviation units
+    tc: float
+        proportional transaction costs per trade
+
+    Returns
+    =======
+    performance: pd.DataFrame
+        perf, outperf and trades per symbol (NaN for symbols without data)
+    position: pd.DataFrame
+        (time x symbol) positions
+    trades: pd.DataFrame
+        (time x symbol) units traded on every row after the first
+    strategy: pd.DataFrame
+        (time x symbol) strategy log returns net of costs on every row after the first
+    """
+    values = prices.to_numpy(dtype=float)
+    stats = RollingStats(values)
+    # symbols along the first axis, time along the last one
+    price, sma, std = values.T, stats.mean(SMA).T, stats.std(SMA).T
+    n = price.shape[-1]
+    returns = np.full(price.shape, np.nan)
+    returns[:, 1:] = np.log(price[:, 1:] / price[:, :-1])
+
+    valid = ~(np.isnan(price) | np.isnan(returns) | np.isnan(sma) | np.isnan(std))
+    start = np.where(valid.any(axis=-1), valid.argmax(axis=-1), n)[:, None]
+    rows = np.arange(n)
+    price = np.where(valid, price, np.nan)
+    position = meanrev_positions(price, sma, sma - dev * std, sma + dev * std)
+    # the first kept row only sets the position, the second trades nothing
+    kept = valid & (rows > start)
+    second = np.where(kept.any(axis=-1), kept.argmax(axis=-1), n)[:, None]
+    returns = np.where(kept, returns, 0.0)
+    strategy, trades = strategy_returns(position, returns)
+    trades[rows[:-1] < second] = 0.0
+    strategy -= trades * tc
+
+    perf = np.exp(strategy.sum(axis=-1))
+    outperf = perf - np.exp(returns.sum(axis=-1))
+    empty = second[:, 0] >= n
+    performance = pd.DataFrame(
+        {
+            "perf": np.where(empty, np.nan, np.round(perf, 6)),
+            "outperf": np.where(empty, np.nan, np.round(outperf, 6)),
+            "trades": trades.sum(axis=-1).astype(int),
+        },
+        index=prices.columns,
+    )
+
+    def frame(array, index):
+        return pd.DataFrame(array.T, index=index, columns=prices.columns)
+
+    return (
+        performance,
+        frame(position, prices.index),
+        frame(trades, prices.index[1:]),
+        frame(strategy, prices.index[1:]),
+    )
+
+
 class MeanRevBacktester:
     """ Class for the vectorized backtesting of Mean Reversion-based trading strategies.
 
@@ -25,6 +140,10 @@ class MeanRevBacktester:
         end date for data retrieval
     tc: float
         proportional transaction costs per trade
+    data: pd.DataFrame, optional
+        frame holding just the "price" and "returns" columns, skips get_data
+    cache: ResultCache.ResultCache, optional
+        memo cache of evaluate results (defaults to the process-wide cache)
         
     Methods
     =======
@@ -36,6 +155,9 @@ class MeanRevBacktester:
         
     test_strategy:
         runs the backtest for the Mean Reversion-based strategy
+
+    evaluate:
+        computes only the performance metrics of the backtest on numpy arrays
         
     plot_results:
         plots the performance of the strategy compared to buy and hold
@@ -43,11 +165,17 @@ class MeanRevBacktester:
     update_and_run:
         updates parameters and returns the negative absolute performance (for minimization algorithm)
         
+    performance_surface:
+        evaluates every (SMA, dev) pair of the parameter ranges at once
+
     optimize_parameters:
-        implements a brute force optimization for the two parameters
+        finds the best parameters by grid, brute force or adaptive search
+
+    walk_forward:
+        re-optimizes on sliding train windows and stitches the out-of-sample results
     """
 
-    def __init__(self, symbol, SMA, dev, start, end, tc):
+    def __init__(self, symbol, SMA, dev, start, end, tc, data=None, cache=None):
         self.symbol = symbol
         self.SMA = SMA
         self.dev = dev
@@ -55,7 +183,14 @@ class MeanRevBacktester:
         self.end = end
         self.tc = tc
         self.results = None
-        self.get_data()
+        self.cache = cache if cache is not None else get_result_cache()
+        if data is None:
+            self.get_data()
+        else:
+            self.data = data.copy(deep=False)
+            self.fingerprint = fingerprint(self.data[["price", "returns"]])
+            self.stats = RollingStats(self.data["price"].to_numpy())
+            self.set_parameters(SMA, dev)
 
     def __repr__(self):
         rep = "MeanRevBacktester(symbol = {}, SMA = {}, dev = {}, start = {}, end = {})"
@@ -64,40 +199,35 @@ class MeanRevBacktester:
     def get_data(self):
         """ Retrieves and prepares the data.
         """
-        stock = FI.FinancialInstrument(self.symbol)
+        stock = FI.FinancialInstrument(self.symbol, lazy=True)
         stock.get_data_extended("2019-01-01", "day")
         raw = stock.data_df
         raw = raw["close"].to_frame().dropna()
         raw.rename(columns={"close": "price"}, index={"date": "time"}, inplace=True)
         raw = raw.loc[self.start : self.end]
         raw["returns"] = np.log(raw / raw.shift(1))
-        raw["SMA"] = raw["price"].rolling(self.SMA).mean()
-        raw["Lower"] = raw["SMA"] - raw["price"].rolling(self.SMA).std() * self.dev
-        raw["Upper"] = raw["SMA"] + raw["price"].rolling(self.SMA).std() * self.dev
         self.data = raw
+        self.fingerprint = fingerprint(raw[["price", "returns"]])
+        self.stats = RollingStats(raw["price"].to_numpy())
+        self.set_parameters(self.SMA, self.dev)
         return raw
 
     def set_parameters(self, SMA=None, dev=None):
         """ Updates parameters and resp. time series.
+
+        Rolling means and standard deviations come from the cached rolling
+        statistics of the price, so each SMA window is computed only once.
         """
         if SMA is not None:
             self.SMA = SMA
-            self.data["SMA"] = self.data["price"].rolling(self.SMA).mean()
-            self.data["Lower"] = (
-                self.data["SMA"] - self.data["price"].rolling(self.SMA).std() * self.dev
-            )
-            self.data["Upper"] = (
-                self.data["SMA"] + self.data["price"].rolling(self.SMA).std() * self.dev
-            )
-
         if dev is not None:
             self.dev = dev
-            self.data["Lower"] = (
-                self.data["SMA"] - self.data["price"].rolling(self.SMA).std() * self.dev
-            )
-            self.data["Upper"] = (
-                self.data["SMA"] + self.data["price"].rolling(self.SMA).std() * self.dev
-            )
+        if SMA is not None or dev is not None:
+            sma = self.stats.mean(self.SMA)
+            width = self.stats.std(self.SMA) * self.dev
+            self.data["SMA"] = sma
+            self.data["Lower"] = sma - width
+            self.data["Upper"] = sma + width
 
     def test_strategy(self):
         """ Backtests the trading strategy.
@@ -130,6 +260,74 @@ class MeanRevBacktester:
 
         return round(perf, 6), round(outperf, 6)
 
+    def evaluate(self):
+        """ Returns performance, outperformance and units traded of the strategy
+        without building the results dataframe (fast path for optimizers).
+
+        Results are memoized in the cache by data fingerprint and parameters.
+        """
+        key = (
+            self.fingerprint,
+            "MeanRev",
+            int(self.SMA),
+            round(float(self.dev), 10),
+            self.tc,
+        )
+        return self.cache.get_or_compute(key, self._evaluate)
+
+    def _evaluate(self):
+        columns = [
+            self.data[column].to_numpy(dtype=float)
+            for column in ("price", "returns", "SMA", "Lower", "Upper")
+        ]
+        rows = kept_rows(*columns)
+        price, returns, sma, lower, upper = (column[rows] for column in columns)
+        position = meanrev_positions(price, sma, lower, upper)
+        perf, outperf, trades = strategy_metrics(position, returns, self.tc)
+        return round(perf, 6), round(outperf, 6), int(trades)
+
+    def tc_sensitivity(self, tcs):
+        """ Backtests the current parameters for many transaction cost levels in
+        one pass (the positions and trades do not depend on tc).
+
+        Parameters
+        ==========
+        tcs: array-like
+            proportional transaction costs per trade
+
+        Returns
+        =======
+        performance: pd.DataFrame
+            perf and outperf per cost level
+        equity: pd.DataFrame
+            (time x cost level) cumulative net performance
+        breakeven: pd.Series
+            costs at which the strategy breaks even and matches buy and hold
+        """
+        columns = [
+            self.data[column].to_numpy(dtype=float)
+            for column in ("price", "returns", "SMA", "Lower", "Upper")
+        ]
+        rows = kept_rows(*columns)
+        price, returns, sma, lower, upper = (column[rows] for column in columns)
+        position = meanrev_positions(price, sma, lower, upper)
+        strategy, trades = strategy_returns(position, returns)
+        tcs = np.asarray(tcs, dtype=float)
+        equity = np.exp(cost_curves(strategy, trades, tcs))
+        buy_and_hold = returns[1:].sum()
+        performance = pd.DataFrame(
+            {"perf": equity[-1], "outperf": equity[-1] - np.exp(buy_and_hold)},
+            index=pd.Index(tcs, name="tc"),
+        ).round(6)
+        breakeven = pd.Series(
+            {
+                "zero": breakeven_tc(strategy, trades),
+                "buy_and_hold": breakeven_tc(strategy, trades, buy_and_hold),
+            }
+        )
+        index = self.data.index[rows][1:]
+        return performance, pd.DataFrame(equity, index=index, columns=tcs), breakeven
+
     def plot_results(self):
         """ Plots the cumulative performance of the trading strategy
         compared to buy and hold.
@@ -150,19 +348,128 @@ class MeanRevBacktester:
         Params: tuple
             parameter tuple with SMA and dist
         """
-        self.set_parameters(int(boll[0]), int(boll[1]))
-        return -self.test_strategy()[0]
+        self.set_parameters(int(boll[0]), float(boll[1]))
+        return -self.evaluate()[0]
+
+    def performance_surface(self, SMA_range, dev_range):
+        """ Returns the absolute performance of every (SMA, dev) pair as a
+        dataframe (SMA x dev). Each SMA window takes one pass over the cached
+        rolling statistics, the bands of all devs are formed by broadcasting.
+
+        Parameters
+        ==========
+        SMA_range, dev_range: tuple
+            tuples of the form (start, end, step size)
+        """
+        windows = np.mgrid[slice(*SMA_range)].astype(int)
+        devs = np.mgrid[slice(*dev_range)].astype(float)
+        perf = self._surface(windows, devs)
+        return pd.DataFrame(
+            np.round(perf, 6),
+            index=pd.Index(windows, name="SMA"),
+            columns=pd.Index(devs, name="dev"),
+        )
+
+    def _surface(self, windows, devs, rows=slice(None)):
+        """ Performance array of every (SMA, dev) pair over a slice of the rows.
+        """
+        price = self.data["price"].to_numpy(dtype=float)[rows]
+        returns = self.data["returns"].to_numpy(dtype=float)[rows]
+        perf = np.empty((len(windows), len(devs)))
+        for i, window in enumerate(windows):
+            sma, std = self.stats.mean(window)[rows], self.stats.std(window)[rows]
+            kept = kept_rows(price, returns, sma, std)
+            width = devs[:, None] * std[kept]
+            position = meanrev_positions(
+                price[kept], sma[kept], sma[kept] - width, sma[kept] + width
+            )
+            perf[i] = strategy_metrics(position, returns[kept], self.tc)[0]
+        return perf
+
+    def _window_returns(self, boll, lo, hi, held=None):
+        """ Strategy log returns of rows [lo, hi) trading boll = (SMA, dev) and
+        the position on row hi - 1.
+
+        Row lo - 1 holds `held`, the position carried over from the previous
+        window, which later rows keep until a signal; without one it is
+        positioned by its own signal. Changing the held position costs tc.
+        """
+        rows = slice(lo - 1, hi)
+        price = self.data["price"].to_numpy(dtype=float)[rows]
+        sma = self.stats.mean(int(boll[0]))[rows]
+        width = self.stats.std(int(boll[0]))[rows] * boll[1]
+        position = meanrev_positions(price, sma, sma - width, sma + width, held)
+        returns = np.nan_to_num(self.data["returns"].to_numpy(dtype=float)[rows])
+        strategy, _ = strategy_returns(
+            position, returns, self.tc, carried=held is not None
+        )
+        return strategy, position[-1]
 
-    def optimize_parameters(self, SMA_range, dev_range):
+    def optimize_parameters(self, SMA_range, dev_range, method="brute"):
         """ Finds global maximum given the parameter ranges.
 
         Parameters
         ==========
         SMA_range, dist_range: tuple
             tuples of the form (start, end, step size)
+        method: str or optimizers.Optimizer
+            "grid" evaluates the whole grid at once with performance_surface,
+            "brute" runs scipy's brute over update_and_run, "pattern" (or any
+            Optimizer instance) searches adaptively within its budget
+            and treats dev as continuous
+        """
+        if method == "grid":
+            surface = self.performance_surface(SMA_range, dev_range)
+            i, j = np.unravel_index(np.nanargmax(surface.to_numpy()), surface.shape)
+            opt = np.array([surface.index[i], surface.columns[j]], dtype=float)
+        else:
+            opt, _ = get_optimizer(method).minimize(
+                self.update_and_run, (SMA_range, dev_range), integer=(True, False)
+            )
+            # the evaluated points reach the disk tier in one commit
+            self.cache.flush()
+        self.set_parameters(int(opt[0]), float(opt[1]))
+        # the results dataframe reflects the optimum
+        return opt, self.test_strategy()[0]
+
+    def walk_forward(self, train, test, SMA_range, dev_range, max_workers=None):
+        """ Walk-forward optimization: every train window of `train` rows is
+        optimized over the whole grid, the best pair is traded on the following
+        `test` rows, and the windows slide forward by `test` rows.
+
+        The rolling means and standard deviations are computed once for the
+        full series and sliced for every window.
+
+        Parameters
+        ==========
+        train, test: int
+            number of rows in each train and test window
+        SMA_range, dev_range: tuple
+            tuples of the form (start, end, step size)
+        max_workers: int
+            number of train windows optimized at the same time
+
+        Returns
+        =======
+        splits: pd.DataFrame
+            dates, best (SMA, dev) and in-/out-of-sample performance per split
+        results: pd.DataFrame
+            stitched out-of-sample returns, strategy, creturns and cstrategy
         """
-        opt = brute(self.update_and_run, (SMA_range, dev_range), finish=None)
-        return opt, -self.update_and_run(opt)
+        windows = np.mgrid[slice(*SMA_range)].astype(int)
+        devs = np.mgrid[slice(*dev_range)].astype(float)
+        # fill the caches before the worker threads share them
+        self.stats.means(windows)
+        self.stats.stds(windows)
+
+        def optimize(lo, hi):
+            perf = self._surface(windows, devs, slice(lo, hi))
+            i, j = np.unravel_index(np.nanargmax(perf), perf.shape)
+            return (int(windows[i]), float(devs[j])), perf[i, j]
+
+        return wf.walk_forward(
+            self.data, train, test, optimize, self._window_returns, max_workers
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import time
+
+import joblib
+import numpy as np
+
+
+class ModelCache:
+    """ On-disk cache of fitted scikit-learn models.
+
+    A model is stored under a hash of its training features, target, class
+    and hyperparameters, so fitting the same model on the same data again
+    just loads it. Entries older than max_age are dropped, and the least
+    recently used ones go first once the cache outgrows max_bytes.
+
+    Attributes
+    ==========
+    root: str
+        directory holding the cached models (defaults to ./models)
+    max_age: float
+        maximum age of an entry in seconds since its last use (None for no limit)
+    max_bytes: int
+        maximum total size of the cache in bytes (None for no limit)
+
+    Methods
+    =======
+    key:
+        returns the cache key of a model fitted on X and y
+
+    load:
+        returns the cached model for a key or None
+
+    save:
+        stores a fitted model and evicts old entries
+
+    fit:
+        returns the cached fit of a model on X and y, fitting and storing it if missing
+
+    evict:
+        drops entries by age and total size
+    """
+
+    def __init__(self, root=None, max_age=30 * 24 * 3600, max_bytes=512 * 2 ** 20):
+        if root is None:
+            root = os.path.join(os.getcwd(), "models")
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def __repr__(self):
+        return "ModelCache(root = {}, max_age = {}, max_bytes = {})".format(
+            self.root, self.max_age, self.max_bytes
+        )
+
+    def _path(self, key):
+        return os.path.join(self.root, "{}.joblib".format(key))
+
+    @staticmethod
+    def key(model, X, y):
+        """ Returns the hex key of `model` (unfitted) trained on X and y.
+        """
+        digest = hashlib.sha1(type(model).__name__.encode())
+        digest.update(repr(sorted(model.get_params().items())).encode())
+        for array in (X, y):
+            array = np.ascontiguousarray(array, dtype=float)
+            digest.update(repr(array.shape).encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def load(self, key):
+        """ Returns the cached model for key, or None.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        age = time.time() - os.path.getmtime(path)
+        if self.max_age is not None and age > self.max_age:
+            os.remove(path)
+            return None
+        model = joblib.load(path)
+        # the modification time records the last use
+        os.utime(path)
+        return model
+
+    def save(self, key, model):
+        """ Stores a fitted model under key.
+        """
+        path = self._path(key)
+        joblib.dump(model, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def fit(self, model, X, y):
+        """ Returns `model` fitted on X and y, from the cache when possible.
+        """
+        key = self.key(model, X, y)
+        fitted = self.load(key)
+        if fitted is None:
+            fitted = model.fit(X, y)
+            self.save(key, fitted)
+        return fitted
+
+    def evict(self):
+        """ Removes expired entries, then the least recently used ones until the
+        cache fits in max_bytes.
+        """
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.root):
+            if not name.endswith(".joblib"):
+                continue
+            path = os.path.join(self.root, name)
+            stat = os.stat(path)
+            if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        if self.max_bytes is None:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
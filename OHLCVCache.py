@@ -0,0 +1,118 @@
+import datetime as dt
+import json
+import os
+
+import pandas as pd
+
+
+class OHLCVCache:
+    """ On-disk columnar cache of historical candles fetched from Kite.
+
+    Candles are kept in one Parquet file per instrument token and interval,
+    next to a small JSON file recording the date range already fetched, so
+    that only the missing ranges have to be requested again.
+
+    Attributes
+    ==========
+    root: str
+        directory holding the cache files (defaults to ./cache)
+
+    Methods
+    =======
+    load:
+        reads the cached candles and covered date range for a token/interval
+
+    save:
+        writes candles and their covered date range to disk
+
+    missing_ranges:
+        lists the (from, to) date ranges not yet covered by the cache
+
+    update:
+        fetches the missing ranges, merges them into the cache and returns the candles
+    """
+
+    def __init__(self, root=None):
+        if root is None:
+            root = os.path.join(os.getcwd(), "cache")
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def __repr__(self):
+        return "OHLCVCache(root = {})".format(self.root)
+
+    def _path(self, token, interval, ext):
+        return os.path.join(self.root, "{}_{}.{}".format(int(token), interval, ext))
+
+    def load(self, token, interval):
+        """ Returns the cached candles with the first and last covered dates,
+        or (None, None, None) when nothing is cached yet.
+        """
+        data_loc = self._path(token, interval, "parquet")
+        meta_loc = self._path(token, interval, "json")
+        if not (os.path.exists(data_loc) and os.path.exists(meta_loc)):
+            return None, None, None
+        with open(meta_loc, "r") as f:
+            meta = json.load(f)
+        data = pd.read_parquet(data_loc)
+        start = dt.date.fromisoformat(meta["start"])
+        end = dt.date.fromisoformat(meta["end"])
+        return data, start, end
+
+    def save(self, token, interval, data, start, end):
+        """ Writes the candles and the covered date range to disk.
+        """
+        data.to_parquet(self._path(token, interval, "parquet"))
+        with open(self._path(token, interval, "json"), "w") as f:
+            json.dump({"start": start.isoformat(), "end": end.isoformat()}, f)
+
+    def missing_ranges(self, start, end, cached_start, cached_end):
+        """ Lists the (from, to) date ranges that still have to be fetched.
+
+        The last cached day is always fetched again since its candles may
+        have been incomplete when they were stored.
+        """
+        if cached_start is None:
+            return [(start, end)]
+        ranges = []
+        if start < cached_start:
+            ranges.append((start, cached_start))
+        if end >= cached_end:
+            ranges.append((cached_end, end))
+        return ranges
+
+    def update(self, token, interval, start, end, fetch):
+        """ Tops up the cache for the given date range and returns the candles.
+
+        Parameters
+        ==========
+        token: int
+            instrument token
+        interval: str
+            candle interval as understood by Kite
+        start, end: datetime.date
+            date range that must be covered
+        fetch: callable
+            fetch(from_date, to_date) returning a date-indexed dataframe
+        """
+        data, cached_start, cached_end = self.load(token, interval)
+        frames = [] if data is None else [data]
+        for from_date, to_date in self.missing_ranges(
+            start, end, cached_start, cached_end
+        ):
+            fetched = fetch(from_date, to_date)
+            if len(fetched):
+                frames.append(fetched)
+        if not frames:
+            return pd.DataFrame(
+                columns=["open", "high", "low", "close", "volume"],
+                index=pd.DatetimeIndex([], name="date"),
+            )
+        data = pd.concat(frames)
+        data.index = pd.to_datetime(data.index)
+        # newer downloads win over the stored copy of the same candle
+        data = data[~data.index.duplicated(keep="last")].sort_index()
+        if cached_start is not None:
+            start, end = min(start, cached_start), max(end, cached_end)
+        self.save(token, interval, data, start, end)
+        return data
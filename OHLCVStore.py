@@ -0,0 +1,226 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class OHLCVView:
+    """ Read-only, memory-mapped columns of one symbol/interval in an OHLCVStore.
+
+    Every column is a numpy memmap, nothing is read into memory until it is
+    touched, and slicing with between() returns views of the same files.
+
+    Attributes
+    ==========
+    timestamp: np.ndarray
+        int64 epoch nanoseconds (UTC)
+    open, high, low, close: np.ndarray
+        float32 prices
+    volume: np.ndarray
+        int64 volumes
+    tz: str
+        time zone of the original index
+
+    Methods
+    =======
+    between:
+        returns a zero-copy view restricted to a time range
+
+    series:
+        returns one column as a pandas Series sharing the mapped memory
+
+    to_frame:
+        returns the columns as a dataframe indexed by date
+    """
+
+    FIELDS = ["open", "high", "low", "close", "volume"]
+
+    def __init__(self, columns, tz):
+        self.timestamp = columns["timestamp"]
+        self.open = columns["open"]
+        self.high = columns["high"]
+        self.low = columns["low"]
+        self.close = columns["close"]
+        self.volume = columns["volume"]
+        self.tz = tz
+
+    def __repr__(self):
+        return "OHLCVView(bars = {}, tz = {})".format(len(self), self.tz)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @property
+    def index(self):
+        index = pd.DatetimeIndex(self.timestamp.view("datetime64[ns]"), name="date")
+        if self.tz is not None:
+            index = index.tz_localize("UTC").tz_convert(self.tz)
+        return index
+
+    def between(self, start=None, end=None):
+        """ Returns the bars with start <= date <= end as a view of the same files.
+        """
+        lo, hi = 0, len(self)
+        if start is not None:
+            lo = np.searchsorted(self.timestamp, self._epoch(start), side="left")
+        if end is not None:
+            hi = np.searchsorted(self.timestamp, self._epoch(end), side="right")
+        columns = {"timestamp": self.timestamp[lo:hi]}
+        for field in self.FIELDS:
+            columns[field] = getattr(self, field)[lo:hi]
+        return OHLCVView(columns, self.tz)
+
+    def _epoch(self, stamp):
+        stamp = pd.Timestamp(stamp)
+        if stamp.tzinfo is None and self.tz is not None:
+            stamp = stamp.tz_localize(self.tz)
+        if stamp.tzinfo is not None:
+            stamp = stamp.tz_convert("UTC").tz_localize(None)
+        return np.datetime64(stamp, "ns").astype(np.int64)
+
+    def series(self, field):
+        """ Returns one column as a Series backed by the memory-mapped file.
+        """
+        return pd.Series(
+            getattr(self, field), index=self.index, name=field, copy=False
+        )
+
+    def to_frame(self, fields=None):
+        """ Returns the selected columns (default all) as a dataframe.
+
+        pandas consolidates columns of equal dtype into one block, so unlike
+        series() this copies the selected columns into memory.
+        """
+        fields = self.FIELDS if fields is None else fields
+        return pd.DataFrame(
+            {field: getattr(self, field) for field in fields}, index=self.index
+        )
+
+
+class OHLCVStore:
+    """ Compact on-disk store of candles laid out for memory mapping.
+
+    Each symbol/interval is a directory of flat binary columns: int64 epoch
+    nanosecond timestamps, float32 open/high/low/close and int64 volume, plus
+    a json file with the number of bars and the time zone. Reading maps the
+    files instead of loading them, so years of intraday bars for many symbols
+    can be worked on without holding them in RAM.
+
+    Attributes
+    ==========
+    root: str
+        directory holding the store (defaults to ./store)
+
+    Methods
+    =======
+    write:
+        replaces the stored bars of a symbol/interval with a candle dataframe
+
+    append:
+        adds the bars of a candle dataframe newer than the last stored bar
+
+    read:
+        maps the stored bars of a symbol/interval as an OHLCVView
+
+    symbols:
+        lists the symbols stored for an interval
+    """
+
+    DTYPES = {
+        "timestamp": np.int64,
+        "open": np.float32,
+        "high": np.float32,
+        "low": np.float32,
+        "close": np.float32,
+        "volume": np.int64,
+    }
+
+    def __init__(self, root=None):
+        if root is None:
+            root = os.path.join(os.getcwd(), "store")
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def __repr__(self):
+        return "OHLCVStore(root = {})".format(self.root)
+
+    def _dir(self, symbol, interval):
+        return os.path.join(self.root, interval, symbol)
+
+    def _meta(self, symbol, interval):
+        meta_loc = os.path.join(self._dir(symbol, interval), "meta.json")
+        if not os.path.exists(meta_loc):
+            return None
+        with open(meta_loc, "r") as f:
+            return json.load(f)
+
+    def _columns(self, data):
+        index = pd.DatetimeIndex(data.index)
+        tz = None if index.tz is None else str(index.tz)
+        if tz is not None:
+            index = index.tz_convert("UTC").tz_localize(None)
+        columns = {"timestamp": index.values.astype("datetime64[ns]").view(np.int64)}
+        for field in OHLCVView.FIELDS:
+            columns[field] = data[field].to_numpy(dtype=self.DTYPES[field])
+        return columns, tz
+
+    def _write(self, symbol, interval, data, mode):
+        meta = self._meta(symbol, interval) if mode == "ab" else None
+        columns, tz = self._columns(data)
+        if meta is not None:
+            tz = meta["tz"]
+        path = self._dir(symbol, interval)
+        os.makedirs(path, exist_ok=True)
+        for field, values in columns.items():
+            with open(os.path.join(path, field + ".bin"), mode) as f:
+                f.write(np.ascontiguousarray(values).tobytes())
+        length = len(data) + (0 if meta is None else meta["length"])
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"length": length, "tz": tz}, f)
+
+    def write(self, symbol, interval, data):
+        """ Replaces the stored bars with those of a date-indexed candle dataframe.
+        """
+        self._write(symbol, interval, data.sort_index(), "wb")
+
+    def append(self, symbol, interval, data):
+        """ Appends the bars of data that are newer than the last stored bar.
+        """
+        meta = self._meta(symbol, interval)
+        if meta is None or meta["length"] == 0:
+            self.write(symbol, interval, data)
+            return
+        last = self.read(symbol, interval).index[-1]
+        data = data.sort_index()
+        data = data[data.index > last]
+        if len(data):
+            self._write(symbol, interval, data, "ab")
+
+    def read(self, symbol, interval):
+        """ Maps the stored bars of a symbol/interval without loading them.
+        """
+        meta = self._meta(symbol, interval)
+        if meta is None:
+            raise KeyError("{} ({}) is not in the store".format(symbol, interval))
+        path = self._dir(symbol, interval)
+        columns = {}
+        for field, dtype in self.DTYPES.items():
+            if meta["length"] == 0:
+                columns[field] = np.empty(0, dtype=dtype)
+            else:
+                columns[field] = np.memmap(
+                    os.path.join(path, field + ".bin"),
+                    dtype=dtype,
+                    mode="r",
+                    shape=(meta["length"],),
+                )
+        return OHLCVView(columns, meta["tz"])
+
+    def symbols(self, interval):
+        """ Lists the symbols stored for an interval.
+        """
+        path = os.path.join(self.root, interval)
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.listdir(path))
@@ -0,0 +1,215 @@
+import inspect
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from ResultCache import ResultCache
+
+# shared memory blocks already attached by this (worker) process
+_attached = {}
+# result caches opened by this (worker) process, by (maxsize, path)
+_caches = {}
+# testers built by this (worker) process, by shared memory block
+_testers = {}
+
+
+def _share(index, values):
+    """ Copies the (rows x 2) price/returns values and the int64 index stamps
+    into one new shared memory block: values first, then the stamps.
+    """
+    if isinstance(index, pd.DatetimeIndex):
+        stamps, spec = index.asi8, ("datetime", index.unit, index.tz, index.name)
+    else:
+        stamps = np.asarray(index, dtype=np.int64)
+        spec = ("int", None, None, index.name)
+    block = shared_memory.SharedMemory(
+        create=True, size=max(values.nbytes + stamps.nbytes, 1)
+    )
+    shared_values, shared_stamps = _views(block, len(values))
+    shared_values[:] = values
+    shared_stamps[:] = stamps
+    return block, spec
+
+
+def _views(block, rows):
+    values = np.ndarray((rows, 2), dtype=np.float64, buffer=block.buf)
+    stamps = np.ndarray(
+        (rows,), dtype=np.int64, buffer=block.buf, offset=values.nbytes
+    )
+    return values, stamps
+
+
+def _attach(name, rows, spec):
+    """ Returns the shared price/returns frame, indexed like the parent's data.
+    """
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    values, stamps = _views(_attached[name], rows)
+    kind, unit, tz, index_name = spec
+    if kind == "datetime":
+        index = pd.DatetimeIndex(stamps.view("M8[{}]".format(unit)), name=index_name)
+        if tz is not None:
+            index = index.tz_localize("UTC").tz_convert(tz)
+    else:
+        index = pd.Index(stamps, name=index_name)
+    return pd.DataFrame(values, index=index, columns=["price", "returns"], copy=False)
+
+
+def _open_cache(maxsize, path):
+    if (maxsize, path) not in _caches:
+        _caches[maxsize, path] = ResultCache(maxsize, path)
+    return _caches[maxsize, path]
+
+
+def _evaluate_chunk(cls, init_args, cache, name, rows, spec, points):
+    """ Worker: evaluates a chunk of grid points for one tester on the shared prices.
+
+    The tester is built on the first chunk of its block and reused after.
+    """
+    if name not in _testers:
+        # same index as the parent's data, so results share its cache fingerprint
+        data = _attach(name, rows, spec)
+        if cache is not None:
+            init_args = dict(init_args, cache=_open_cache(*cache))
+        _testers[name] = cls(data=data, **init_args)
+    tester = _testers[name]
+    perf = [-tester.update_and_run(point) for point in points]
+    if cache is not None:
+        # the pool gives no hook at worker exit, so every chunk commits
+        tester.cache.flush()
+    return perf
+
+
+class ParallelOptimizer:
+    """ Class for optimizing backtester parameters over many symbols on all cores.
+
+    The price, returns and index stamps of every tester are copied once into
+    shared memory, each worker builds a tester once per block and reuses it,
+    the (symbol x parameter grid) points are split into chunks that worker
+    processes evaluate against those shared arrays, and results are collected
+    as the chunks complete.
+
+    Attributes
+    ==========
+    max_workers: int
+        number of worker processes (defaults to the number of cores)
+    chunksize: int
+        number of grid points evaluated per task
+    progress: bool or callable
+        True prints progress, a callable is called as progress(done, total, symbol)
+    results: pd.DataFrame
+        performance of every evaluated (tester, parameters) point
+
+    Methods
+    =======
+    optimize:
+        finds the best parameters of every backtester over the parameter ranges
+    """
+
+    def __init__(self, max_workers=None, chunksize=100, progress=True):
+        self.max_workers = max_workers
+        self.chunksize = chunksize
+        self.progress = progress
+        self.results = None
+
+    def __repr__(self):
+        return "ParallelOptimizer(max_workers = {}, chunksize = {})".format(
+            self.max_workers, self.chunksize
+        )
+
+    def _report(self, done, total, symbol):
+        if callable(self.progress):
+            self.progress(done, total, symbol)
+        elif self.progress:
+            print("{}/{} chunks done (last: {})".format(done, total, symbol))
+
+    @staticmethod
+    def _init_args(tester):
+        signature = inspect.signature(type(tester).__init__)
+        return {
+            name: getattr(tester, name)
+            for name in signature.parameters
+            if name not in ("self", "data", "cache")
+        }
+
+    @staticmethod
+    def _cache_spec(tester):
+        # workers open the cache once each from its settings rather than
+        # unpickling a copy (and a new sqlite connection) with every chunk
+        cache = getattr(tester, "cache", None)
+        if cache is None:
+            return None
+        return cache.maxsize, cache.path
+
+    def optimize(self, testers, ranges):
+        """ Finds the best parameters of every backtester over the same ranges.
+
+        Parameters
+        ==========
+        testers: list
+            SMABacktester or MeanRevBacktester instances with loaded data
+        ranges: tuple
+            parameter ranges of the form (start, end, step size), as for
+            optimize_parameters
+
+        Returns
+        =======
+        dict of tester position in testers -> (optimal parameters, performance),
+        with ties resolved to the first grid point like scipy's brute (testers
+        may share a symbol, e.g. over different periods)
+        """
+        grid = np.mgrid[tuple(slice(*r) for r in ranges)]
+        points = grid.reshape(len(ranges), -1).T
+        blocks, tasks = [], []
+        try:
+            for position, tester in enumerate(testers):
+                values = tester.data[["price", "returns"]].to_numpy(dtype=np.float64)
+                block, spec = _share(tester.data.index, values)
+                blocks.append(block)
+                for lo in range(0, len(points), self.chunksize):
+                    tasks.append(
+                        (
+                            position,
+                            lo,
+                            (
+                                type(tester),
+                                self._init_args(tester),
+                                self._cache_spec(tester),
+                                block.name,
+                                len(values),
+                                spec,
+                                points[lo : lo + self.chunksize],
+                            ),
+                        )
+                    )
+
+            perf = [np.empty(len(points)) for _ in testers]
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {
+                    pool.submit(_evaluate_chunk, *args): (position, lo)
+                    for position, lo, args in tasks
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    position, lo = futures[future]
+                    chunk = future.result()
+                    perf[position][lo : lo + len(chunk)] = chunk
+                    self._report(done, len(futures), testers[position].symbol)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        frames, best = [], {}
+        for position, values in enumerate(perf):
+            columns = ["param{}".format(k + 1) for k in range(len(ranges))]
+            frame = pd.DataFrame(points, columns=columns)
+            frame.insert(0, "tester", position)
+            frame.insert(1, "symbol", testers[position].symbol)
+            frame["perf"] = values
+            frames.append(frame)
+            i = np.nanargmax(values)
+            best[position] = (points[i], values[i])
+        self.results = pd.concat(frames, ignore_index=True)
+        return best
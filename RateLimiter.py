@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """ Thread-safe limiter spacing calls to an API endpoint evenly.
+
+    Every caller reserves the next free time slot under a lock and then sleeps
+    until that slot, so any number of threads together never exceed `rate`
+    calls per second.
+
+    Attributes
+    ==========
+    rate: float
+        maximum number of calls per second
+
+    Methods
+    =======
+    wait:
+        blocks until the caller is allowed to make its call
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._interval = 1.0 / rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "RateLimiter(rate = {})".format(self.rate)
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def wait(self):
+        """ Blocks until the next call slot is reached.
+        """
+        with self._lock:
+            slot = max(time.monotonic(), self._next_slot)
+            self._next_slot = slot + self._interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def fingerprint(data):
+    """ Returns a short hex digest identifying the index and values of a
+    dataframe (e.g. a backtester's "price" and "returns" columns).
+    """
+    digest = hashlib.sha1(repr(list(data.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class ResultCache:
+    """ Memo cache of backtest results with LRU eviction and an optional
+    on-disk (sqlite) tier shared across sessions and processes.
+
+    Keys are tuples such as (data fingerprint, strategy, parameters..., tc).
+    Results evicted from memory stay on disk when a path is given. Disk writes
+    are committed in batches, so other processes see them after flush().
+
+    Attributes
+    ==========
+    maxsize: int
+        maximum number of results kept in memory
+    path: str
+        sqlite file of the on-disk tier (None for memory only)
+    batch: int
+        number of results written to disk per commit
+    hits, misses: int
+        lookup counters
+
+    Methods
+    =======
+    get:
+        returns a cached result or None
+
+    put:
+        stores a result in memory (and on disk)
+
+    flush:
+        commits the results written to disk since the last commit
+
+    get_or_compute:
+        returns the cached result for a key, computing and storing it if missing
+
+    clear:
+        drops all cached results (memory and disk)
+    """
+
+    def __init__(self, maxsize=4096, path=None, batch=256):
+        self.maxsize = maxsize
+        self.path = path
+        self.batch = batch
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._pending = 0
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            # readers do not block the writer, and commits skip the fsync
+            # that only protects against power loss
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)"
+            )
+            self._db.commit()
+
+    def __repr__(self):
+        return "ResultCache(maxsize = {}, path = {}, cached = {})".format(
+            self.maxsize, self.path, len(self._memory)
+        )
+
+    def __getstate__(self):
+        # worker processes get their own (empty) memory tier and connection
+        return {"maxsize": self.maxsize, "path": self.path, "batch": self.batch}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @staticmethod
+    def _disk_key(key):
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """ Returns the cached result for key, or None.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM results WHERE key = ?", (self._disk_key(key),)
+                ).fetchone()
+                if row is not None:
+                    value = pickle.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """ Stores the result for key.
+        """
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+                    (self._disk_key(key), pickle.dumps(value)),
+                )
+                self._pending += 1
+                if self._pending >= self.batch:
+                    self._db.commit()
+                    self._pending = 0
+
+    def flush(self):
+        """ Commits the results not yet committed to disk.
+        """
+        with self._lock:
+            if self._db is not None and self._pending:
+                self._db.commit()
+                self._pending = 0
+
+    def get_or_compute(self, key, compute):
+        """ Returns the cached result for key, calling compute() on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """ Drops every cached result.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+                self._pending = 0
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_result_cache():
+    """ Returns the process-wide in-memory cache the backtesters share by default.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ResultCache()
+        return _default
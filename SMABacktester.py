@@ -1,12 +1,63 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import brute
 import FinancialInstrument as FI
+from metrics import kept_rows, strategy_metrics, strategy_returns
+from optimizers import get_optimizer
+from rolling_stats import RollingStats
+from ResultCache import fingerprint, get_result_cache
+import walk_forward as wf
 
 plt.style.use("seaborn")
 
 
+def sma_surface(means_s, means_l, returns):
+    """ Performance and outperformance of every (SMA_S, SMA_L) pair at once.
+
+    Each pair is evaluated over the same rows test_strategy keeps after
+    dropna, i.e. from the first row where both SMAs and the return exist.
+
+    Parameters
+    ==========
+    means_s, means_l: np.ndarray
+        (windows x time) arrays of the short and long SMAs
+    returns: np.ndarray
+        log returns over the same time axis
+
+    Returns
+    =======
+    perf, outperf: np.ndarray
+        (short windows x long windows) arrays, NaN where no row is left
+    """
+    n = len(returns)
+
+    def first_valid(values):
+        valid = ~np.isnan(values)
+        return np.where(valid.any(axis=-1), valid.argmax(axis=-1), n)
+
+    # the position held on row k earns the return of row k + 1
+    start = np.maximum(
+        np.maximum.outer(first_valid(means_s), first_valid(means_l)),
+        first_valid(returns),
+    )
+    next_returns = np.nan_to_num(returns[1:])
+    next_returns[: first_valid(returns)] = 0.0
+    tail = np.append(np.cumsum(next_returns[::-1])[::-1], 0.0)
+
+    long_returns = np.empty(start.shape)
+    for i in range(len(means_s)):
+        above = means_s[i, :-1] > means_l[:, :-1]
+        long_returns[i] = above.astype(float) @ next_returns
+
+    empty = start >= n - 1
+    start = np.minimum(start, n - 1)
+    # positions are +1 above and -1 below, summed from the first kept row
+    strategy = 2 * long_returns - tail[start]
+    perf = np.where(empty, np.nan, np.exp(strategy))
+    outperf = perf - np.exp(tail[start])
+    return perf, outperf
+
+
 class SMABacktester:
     """ Class for the vectorized backtesting of SMA-based trading strategies.
 
@@ -22,6 +73,10 @@ class SMABacktester:
         start date for data retrieval
     end: str
         end date for data retrieval
+    data: pd.DataFrame, optional
+        frame holding just the "price" and "returns" columns, skips get_data
+    cache: ResultCache.ResultCache, optional
+        memo cache of evaluate results (defaults to the process-wide cache)
 
 
     Methods
@@ -35,24 +90,40 @@ class SMABacktester:
     test_strategy:
         runs the backtest for the SMA-based strategy
 
+    evaluate:
+        computes only the performance metrics of the backtest on numpy arrays
+
     plot_results:
         plots the performance of the strategy compared to buy and hold
 
     update_and_run:
         updates SMA parameters and returns the negative absolute performance (for minimization algorithm)
 
+    performance_surface:
+        evaluates every pair of the two SMA parameter ranges in one vectorized pass
+
     optimize_parameters:
-        implements a brute force optimization for the two SMA parameters
+        finds the best SMA parameters by grid, brute force or adaptive search
+
+    walk_forward:
+        re-optimizes on sliding train windows and stitches the out-of-sample results
     """
 
-    def __init__(self, symbol, SMA_S, SMA_L, start, end):
+    def __init__(self, symbol, SMA_S, SMA_L, start, end, data=None, cache=None):
         self.symbol = symbol
         self.SMA_S = SMA_S
         self.SMA_L = SMA_L
         self.start = start
         self.end = end
         self.results = None
-        self.get_data()
+        self.cache = cache if cache is not None else get_result_cache()
+        if data is None:
+            self.get_data()
+        else:
+            self.data = data.copy(deep=False)
+            self.fingerprint = fingerprint(self.data[["price", "returns"]])
+            self.stats = RollingStats(self.data["price"].to_numpy())
+            self.set_parameters(SMA_S, SMA_L)
 
     def __repr__(self):
         return "SMABacktester(symbol = {}, SMA_S = {}, SMA_L = {}, start = {}, end = {})".format(
@@ -62,25 +133,27 @@ class SMABacktester:
     def get_data(self):
         """ Retrieves and prepares the data.
         """
-        stock = FI.FinancialInstrument(self.symbol)
+        stock = FI.FinancialInstrument(self.symbol, lazy=True)
         stock.get_data_extended("2019-01-01", "day")
         raw = stock.data_df
         raw = raw["close"].to_frame().dropna()
         raw.rename(columns={"close": "price"}, index={"date": "time"}, inplace=True)
         raw["returns"] = np.log(raw / raw.shift(1))
-        raw["SMA_S"] = raw["price"].rolling(self.SMA_S).mean()
-        raw["SMA_L"] = raw["price"].rolling(self.SMA_L).mean()
         self.data = raw
+        self.fingerprint = fingerprint(raw[["price", "returns"]])
+        self.stats = RollingStats(raw["price"].to_numpy())
+        self.set_parameters(self.SMA_S, self.SMA_L)
 
     def set_parameters(self, SMA_S=None, SMA_L=None):
-        """ Updates SMA parameters and resp. time series.
+        """ Updates SMA parameters and resp. time series (from the cached
+        rolling means of the price).
         """
         if SMA_S is not None:
             self.SMA_S = SMA_S
-            self.data["SMA_S"] = self.data["price"].rolling(self.SMA_S).mean()
+            self.data["SMA_S"] = self.stats.mean(self.SMA_S)
         if SMA_L is not None:
             self.SMA_L = SMA_L
-            self.data["SMA_L"] = self.data["price"].rolling(self.SMA_L).mean()
+            self.data["SMA_L"] = self.stats.mean(self.SMA_L)
 
     def test_strategy(self):
         """ Backtests the trading strategy.
@@ -98,6 +171,25 @@ class SMABacktester:
         outperf = perf - data["creturns"].iloc[-1]
         return round(perf, 6), round(outperf, 6)
 
+    def evaluate(self):
+        """ Returns performance, outperformance and units traded of the strategy
+        without building the results dataframe (fast path for optimizers).
+
+        Results are memoized in the cache by data fingerprint and parameters.
+        """
+        key = (self.fingerprint, "SMA", int(self.SMA_S), int(self.SMA_L))
+        return self.cache.get_or_compute(key, self._evaluate)
+
+    def _evaluate(self):
+        columns = [
+            self.data[column].to_numpy(dtype=float)
+            for column in ("returns", "SMA_S", "SMA_L")
+        ]
+        returns, sma_s, sma_l = (column[kept_rows(*columns)] for column in columns)
+        position = np.where(sma_s > sma_l, 1.0, -1.0)
+        perf, outperf, trades = strategy_metrics(position, returns)
+        return round(perf, 6), round(outperf, 6), int(trades)
+
     def plot_results(self):
         """ Plots the cumulative performance of the trading strategy
         compared to buy and hold.
@@ -119,18 +211,117 @@ class SMABacktester:
             SMA parameter tuple
         """
         self.set_parameters(int(SMA[0]), int(SMA[1]))
-        return -self.test_strategy()[0]
+        return -self.evaluate()[0]
+
+    def performance_surface(self, SMA1_range, SMA2_range):
+        """ Returns the absolute performance of every (SMA_S, SMA_L) pair as a
+        dataframe (SMA_S x SMA_L), computed from one cumulative sum per series.
+
+        Parameters
+        ==========
+        SMA1_range, SMA2_range: tuple
+            tuples of the form (start, end, step size)
+        """
+        windows_s = np.mgrid[slice(*SMA1_range)].astype(int)
+        windows_l = np.mgrid[slice(*SMA2_range)].astype(int)
+        perf = self._surface(windows_s, windows_l)
+        return pd.DataFrame(
+            np.round(perf, 6),
+            index=pd.Index(windows_s, name="SMA_S"),
+            columns=pd.Index(windows_l, name="SMA_L"),
+        )
+
+    def _surface(self, windows_s, windows_l, rows=slice(None)):
+        """ Performance array of every window pair over a slice of the rows.
+        """
+        perf, _ = sma_surface(
+            self.stats.means(windows_s)[:, rows],
+            self.stats.means(windows_l)[:, rows],
+            self.data["returns"].to_numpy(dtype=float)[rows],
+        )
+        return perf
+
+    def _window_returns(self, SMA, lo, hi, held=None):
+        """ Strategy log returns of rows [lo, hi) trading SMA = (SMA_S, SMA_L)
+        (flat where an SMA is not defined yet) and the position on row hi - 1.
+
+        Row lo - 1 holds `held`, the position carried over from the previous
+        window, or without one is positioned by its own signal.
+        """
+        rows = slice(lo - 1, hi)
+        sma_s = self.stats.mean(SMA[0])[rows]
+        sma_l = self.stats.mean(SMA[1])[rows]
+        position = np.where(sma_s > sma_l, 1.0, -1.0)
+        position[np.isnan(sma_s) | np.isnan(sma_l)] = 0.0
+        if held is not None:
+            position[0] = held
+        returns = np.nan_to_num(self.data["returns"].to_numpy(dtype=float)[rows])
+        strategy, _ = strategy_returns(position, returns, carried=held is not None)
+        return strategy, position[-1]
 
-    def optimize_parameters(self, SMA1_range, SMA2_range):
+    def optimize_parameters(self, SMA1_range, SMA2_range, method="brute"):
         """ Finds global maximum given the SMA parameter ranges.
 
         Parameters
         ==========
         SMA1_range, SMA2_range: tuple
             tuples of the form (start, end, step size)
+        method: str or optimizers.Optimizer
+            "grid" evaluates the whole grid at once with performance_surface,
+            "brute" runs scipy's brute over update_and_run, "pattern" (or any
+            Optimizer instance) searches adaptively within its budget
+        """
+        if method == "grid":
+            surface = self.performance_surface(SMA1_range, SMA2_range)
+            i, j = np.unravel_index(np.nanargmax(surface.to_numpy()), surface.shape)
+            opt = np.array([surface.index[i], surface.columns[j]], dtype=float)
+        else:
+            opt, _ = get_optimizer(method).minimize(
+                self.update_and_run, (SMA1_range, SMA2_range), integer=(True, True)
+            )
+            # the evaluated points reach the disk tier in one commit
+            self.cache.flush()
+        self.set_parameters(int(opt[0]), int(opt[1]))
+        # the results dataframe reflects the optimum
+        return opt, self.test_strategy()[0]
+
+    def walk_forward(self, train, test, SMA1_range, SMA2_range, max_workers=None):
+        """ Walk-forward optimization: every train window of `train` rows is
+        optimized over the whole grid, the best pair is traded on the following
+        `test` rows, and the windows slide forward by `test` rows.
+
+        The rolling means are computed once for the full series and sliced
+        for every window.
+
+        Parameters
+        ==========
+        train, test: int
+            number of rows in each train and test window
+        SMA1_range, SMA2_range: tuple
+            tuples of the form (start, end, step size)
+        max_workers: int
+            number of train windows optimized at the same time
+
+        Returns
+        =======
+        splits: pd.DataFrame
+            dates, best (SMA_S, SMA_L) and in-/out-of-sample performance per split
+        results: pd.DataFrame
+            stitched out-of-sample returns, strategy, creturns and cstrategy
         """
-        opt = brute(self.update_and_run, (SMA1_range, SMA2_range), finish=None)
-        return opt, -self.update_and_run(opt)
+        windows_s = np.mgrid[slice(*SMA1_range)].astype(int)
+        windows_l = np.mgrid[slice(*SMA2_range)].astype(int)
+        # fill the cache before the worker threads share it
+        self.stats.means(np.union1d(windows_s, windows_l))
+
+        def optimize(lo, hi):
+            perf = self._surface(windows_s, windows_l, slice(lo, hi))
+            i, j = np.unravel_index(np.nanargmax(perf), perf.shape)
+            return (int(windows_s[i]), int(windows_l[j])), perf[i, j]
+
+        return wf.walk_forward(
+            self.data, train, test, optimize, self._window_returns, max_workers
+        )
 
 
 if __name__ == "__main__":
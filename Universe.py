@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import FinancialInstrument as FI
+
+
+class Universe:
+    """ Class for loading many tickers at once into an aligned price panel.
+
+    The candles of every ticker are placed on the union of all timestamps in a
+    single contiguous float64 array of shape (timestamps, symbols, fields).
+
+    Attributes
+    ==========
+    tickers: list
+        ticker symbols to load
+    inception_date: str
+        first date to load, format yyyy-mm-dd
+    interval: str
+        candle interval as understood by Kite
+    missing: str
+        handling of bars a ticker does not have:
+            "nan"   - leave them as NaN
+            "ffill" - carry the last close forward as a flat bar with zero volume
+            "drop"  - keep only timestamps at which every ticker has a bar
+    max_workers: int
+        number of tickers downloaded concurrently
+
+    Methods
+    =======
+    get_data:
+        downloads the candles of all tickers and builds the panel
+
+    from_frames:
+        builds a universe from already loaded candle dataframes
+
+    field:
+        returns one field as a (timestamps x symbols) dataframe
+
+    symbol:
+        returns the candles of one ticker as a (timestamps x fields) dataframe
+
+    returns:
+        returns the log returns of one field as a (timestamps x symbols) array
+    """
+
+    FIELDS = ["open", "high", "low", "close", "volume"]
+
+    def __init__(
+        self, tickers, inception_date, interval="day", missing="ffill", max_workers=4
+    ):
+        if missing not in ("nan", "ffill", "drop"):
+            raise ValueError("missing must be one of 'nan', 'ffill' or 'drop'")
+        self.tickers = list(tickers)
+        self.inception_date = inception_date
+        self.interval = interval
+        self.missing = missing
+        self.max_workers = max_workers
+        self.get_data()
+
+    def __repr__(self):
+        rep = "Universe(tickers = {}, inception_date = {}, interval = {}, missing = {})"
+        return rep.format(
+            len(self.tickers), self.inception_date, self.interval, self.missing
+        )
+
+    def get_data(self):
+        """ Downloads the candles of all tickers and builds the panel.
+        """
+        stocks = [FI.FinancialInstrument(ticker, lazy=True) for ticker in self.tickers]
+        if stocks:
+            tokens = stocks[0].instrument_index.lookup_many(self.tickers)
+            unknown = [t for t, token in zip(self.tickers, tokens) if token == -1]
+            if unknown:
+                print("no instrument token for", unknown, "- skipping")
+            stocks = [s for s, token in zip(stocks, tokens) if token != -1]
+
+        def load(stock):
+            stock.get_data_extended(self.inception_date, self.interval)
+            return stock.data_df
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            frames = list(pool.map(load, stocks))
+        self._build_panel(dict(zip([s._ticker for s in stocks], frames)))
+
+    @classmethod
+    def from_frames(cls, frames, missing="ffill"):
+        """ Builds a universe from a dict of ticker -> candle dataframe.
+        """
+        universe = cls.__new__(cls)
+        universe.tickers = list(frames)
+        universe.inception_date = None
+        universe.interval = None
+        universe.missing = missing
+        universe.max_workers = None
+        universe._build_panel(frames)
+        return universe
+
+    def _build_panel(self, frames):
+        symbols = list(frames)
+        stamps = [frames[s].index.values for s in symbols]
+        timestamps = (
+            np.unique(np.concatenate(stamps))
+            if stamps
+            else np.array([], dtype="datetime64[ns]")
+        )
+        values = np.full((len(timestamps), len(symbols), len(self.FIELDS)), np.nan)
+        valid = np.zeros((len(timestamps), len(symbols)), dtype=bool)
+        for j, symbol in enumerate(symbols):
+            rows = np.searchsorted(timestamps, stamps[j])
+            values[rows, j, :] = frames[symbol][self.FIELDS].to_numpy(dtype=float)
+            valid[rows, j] = True
+
+        if self.missing == "ffill" and len(timestamps):
+            # index of the last bar each symbol had at or before every timestamp
+            last = np.where(valid, np.arange(len(timestamps))[:, None], 0)
+            np.maximum.accumulate(last, axis=0, out=last)
+            gap = ~valid & ~np.isnan(values[last, np.arange(len(symbols)), 3])
+            prev_close = values[last, np.arange(len(symbols)), 3][gap]
+            for k in range(4):
+                values[:, :, k][gap] = prev_close
+            values[:, :, 4][gap] = 0.0
+        elif self.missing == "drop":
+            complete = valid.all(axis=1)
+            timestamps = timestamps[complete]
+            values = np.ascontiguousarray(values[complete])
+            valid = valid[complete]
+
+        index = pd.DatetimeIndex(timestamps, name="date")
+        tz = next((f.index.tz for f in frames.values() if len(f)), None)
+        if tz is not None:
+            index = index.tz_localize("UTC").tz_convert(tz)
+        self.symbols = symbols
+        self.index = index
+        self.values = values
+        self.valid = valid
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def field(self, name="close"):
+        """ Returns one field as a (timestamps x symbols) dataframe.
+        """
+        k = self.FIELDS.index(name)
+        return pd.DataFrame(self.values[:, :, k], index=self.index, columns=self.symbols)
+
+    def symbol(self, ticker):
+        """ Returns the candles of one ticker as a (timestamps x fields) dataframe.
+        """
+        j = self.symbols.index(ticker)
+        return pd.DataFrame(self.values[:, j, :], index=self.index, columns=self.FIELDS)
+
+    def returns(self, name="close"):
+        """ Returns the log returns of one field as a (timestamps x symbols) array,
+        NaN in the first row and wherever the price is missing.
+        """
+        price = self.values[:, :, self.FIELDS.index(name)]
+        returns = np.full(price.shape, np.nan)
+        returns[1:] = np.log(price[1:] / price[:-1])
+        return returns
@@ -0,0 +1,344 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:  # plain Python loop over numpy arrays
+
+    def njit(func):
+        return func
+
+
+def true_range(high, low, close):
+    """ True Range of numpy high, low and close arrays (NaN on the first row).
+    """
+    prev_close = np.empty_like(close)
+    prev_close[:1] = np.nan
+    prev_close[1:] = close[:-1]
+    tr = np.abs(high - low)
+    # np.maximum propagates NaN like max(axis=1, skipna=False)
+    tr = np.maximum(tr, np.abs(high - prev_close))
+    return np.maximum(tr, np.abs(low - prev_close))
+
+
+def atr(DF, n):
+    "function to calculate True Range and Average True Range"
+    tr = true_range(
+        DF["high"].to_numpy(dtype=float),
+        DF["low"].to_numpy(dtype=float),
+        DF["close"].to_numpy(dtype=float),
+    )
+    return pd.Series(tr, index=DF.index).ewm(com=n, min_periods=n).mean().rename("ATR")
+
+
+@njit
+def _supertrend_pass(close, basic_upper, basic_lower, n):
+    """ Final bands and supertrend in one pass over the rows, following the
+    band recursion and trend switching rules of the original row loops.
+    """
+    size = len(close)
+    upper = basic_upper.copy()
+    lower = basic_lower.copy()
+    strend = np.full(size, np.nan)
+    started = False
+    for i in range(n, size):
+        # min/max with Python's NaN semantics (the first argument wins)
+        if close[i - 1] <= upper[i - 1]:
+            if upper[i - 1] < basic_upper[i]:
+                upper[i] = upper[i - 1]
+        if close[i - 1] >= lower[i - 1]:
+            if lower[i - 1] > basic_lower[i]:
+                lower[i] = lower[i - 1]
+        if not started:
+            # the trend starts at the first break of either band
+            if close[i - 1] <= upper[i - 1] and close[i] > upper[i]:
+                strend[i] = lower[i]
+                started = True
+            elif close[i - 1] >= lower[i - 1] and close[i] < lower[i]:
+                strend[i] = upper[i]
+                started = True
+        elif strend[i - 1] == upper[i - 1]:
+            if close[i] <= upper[i]:
+                strend[i] = upper[i]
+            elif close[i] >= upper[i]:
+                strend[i] = lower[i]
+        elif strend[i - 1] == lower[i - 1]:
+            if close[i] >= lower[i]:
+                strend[i] = lower[i]
+            elif close[i] <= lower[i]:
+                strend[i] = upper[i]
+    return upper, lower, strend
+
+
+def supertrend(DF, n, m):
+    """function to calculate Supertrend given historical candle data
+        n = n day ATR - usually 7 day ATR is used
+        m = multiplier - usually 2 or 3 is used"""
+    high = DF["high"].to_numpy(dtype=float)
+    low = DF["low"].to_numpy(dtype=float)
+    close = DF["close"].to_numpy(dtype=float)
+    width = m * atr(DF, n).to_numpy()
+    basic_upper = ((high + low) / 2) + width
+    basic_lower = ((high + low) / 2) - width
+    _, _, strend = _supertrend_pass(close, basic_upper, basic_lower, n)
+    return pd.Series(strend, index=DF.index, name="Strend")
+
+
+def _supertrend_batch(close, basic_upper, basic_lower, n):
+    """ _supertrend_pass over every (config, ticker) column at once: arrays are
+    (bars x configs x tickers) and n holds the ATR period of every config.
+    """
+    size = len(close)
+    n = np.asarray(n)[:, None]
+    upper = basic_upper.copy()
+    lower = basic_lower.copy()
+    strend = np.full(close.shape, np.nan)
+    started = np.zeros(close.shape[1:], dtype=bool)
+    for i in range(int(n.min()), size):
+        active = i >= n
+        prev_close, prev_upper, prev_lower = close[i - 1], upper[i - 1], lower[i - 1]
+        keep = active & (prev_close <= prev_upper) & (prev_upper < basic_upper[i])
+        upper[i] = np.where(keep, prev_upper, basic_upper[i])
+        keep = active & (prev_close >= prev_lower) & (prev_lower > basic_lower[i])
+        lower[i] = np.where(keep, prev_lower, basic_lower[i])
+
+        c, u, l = close[i], upper[i], lower[i]
+        row = strend[i]
+        # first break of either band
+        new = active & ~started
+        break_up = new & (prev_close <= prev_upper) & (c > u)
+        break_down = new & ~break_up & (prev_close >= prev_lower) & (c < l)
+        row[break_up] = l[break_up]
+        row[break_down] = u[break_down]
+        # trend switching once started
+        on_upper = active & started & (strend[i - 1] == prev_upper)
+        on_lower = active & started & ~on_upper & (strend[i - 1] == prev_lower)
+        stay = on_upper & (c <= u)
+        flip = on_upper & ~stay & (c >= u)
+        row[stay], row[flip] = u[stay], l[flip]
+        stay = on_lower & (c >= l)
+        flip = on_lower & ~stay & (c <= l)
+        row[stay], row[flip] = l[stay], u[flip]
+        started |= break_up | break_down
+    return strend
+
+
+def supertrend_bank(high, low, close, configs):
+    """ Supertrends of many tickers for many (n, m) configurations at once.
+
+    The True Range is computed once and the ATR once per distinct n, then
+    all supertrend lines advance together bar by bar.
+
+    Parameters
+    ==========
+    high, low, close: np.ndarray
+        (bars x tickers) candles
+    configs: list
+        (n, m) pairs as taken by supertrend
+
+    Returns
+    =======
+    strend: np.ndarray
+        (bars x configs x tickers) supertrend lines, equal to supertrend
+    reversal: np.ndarray
+        (bars x configs x tickers) +1 where the close crosses above the line
+        ("green" in kc_supertrend), -1 where it crosses below ("red"), else 0
+    """
+    high, low, close = (
+        np.asarray(values, dtype=float).reshape(len(values), -1)
+        for values in (high, low, close)
+    )
+    tr = pd.DataFrame(true_range(high, low, close))
+    atrs = {
+        n: tr.ewm(com=n, min_periods=n).mean().to_numpy()
+        for n in sorted({n for n, _ in configs})
+    }
+    middle = (high + low) / 2
+    width = np.stack([m * atrs[n] for n, m in configs], axis=1)
+    close_bank = np.broadcast_to(close[:, None, :], width.shape)
+    strend = _supertrend_batch(
+        close_bank,
+        middle[:, None, :] + width,
+        middle[:, None, :] - width,
+        [n for n, _ in configs],
+    )
+
+    reversal = np.zeros(strend.shape, dtype=np.int8)
+    above, below = strend > close_bank, strend < close_bank
+    reversal[1:][below[1:] & above[:-1]] = 1
+    reversal[1:][above[1:] & below[:-1]] = -1
+    return strend, reversal
+
+
+class StreamingATR:
+    """ Average True Range updated one candle at a time in O(1).
+
+    Follows pandas' ewm(com=n, min_periods=n).mean() over the True Range
+    exactly, so after the same candles it equals atr.
+
+    Attributes
+    ==========
+    n: int
+        ATR period
+    value: float
+        ATR after the last candle (NaN until n True Ranges were seen)
+
+    Methods
+    =======
+    update:
+        adds a closed candle and returns the new ATR
+
+    seed:
+        feeds historical candles
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.value = np.nan
+        self._alpha = 1.0 / (1.0 + n)
+        self._prev_close = np.nan
+        self._weighted = np.nan
+        self._old_wt = 1.0
+        self._nobs = 0
+
+    def __repr__(self):
+        return "StreamingATR(n = {}, value = {})".format(self.n, self.value)
+
+    def update(self, high, low, close):
+        """ Adds one closed candle and returns the ATR.
+        """
+        tr = max(
+            abs(high - low), abs(high - self._prev_close), abs(low - self._prev_close)
+        )
+        if np.isnan(self._prev_close) or np.isnan(high) or np.isnan(low):
+            tr = np.nan
+        self._prev_close = close
+        observed = not np.isnan(tr)
+        self._nobs += observed
+        # the adjusted ewm recursion of pandas
+        if not np.isnan(self._weighted):
+            self._old_wt *= 1.0 - self._alpha
+            if observed:
+                if self._weighted != tr:
+                    self._weighted = (self._old_wt * self._weighted + tr) / (
+                        self._old_wt + 1.0
+                    )
+                self._old_wt += 1.0
+        elif observed:
+            self._weighted = tr
+        self.value = self._weighted if self._nobs >= self.n else np.nan
+        return self.value
+
+    def seed(self, DF):
+        """ Feeds the candles of a dataframe with high, low and close columns.
+        """
+        for high, low, close in DF[["high", "low", "close"]].to_numpy(dtype=float):
+            self.update(high, low, close)
+        return self.value
+
+
+class StreamingSupertrend:
+    """ Supertrend updated one candle at a time in O(1), equal to supertrend
+    computed over all candles fed so far.
+
+    Attributes
+    ==========
+    n: int
+        ATR period
+    m: float
+        band multiplier
+    value: float
+        supertrend after the last candle
+    reversal: int
+        +1 when the last close crossed above the supertrend ("green"),
+        -1 when it crossed below ("red"), else 0
+
+    Methods
+    =======
+    update:
+        adds a closed candle and returns the new supertrend
+
+    seed:
+        feeds historical candles
+
+    verify:
+        checks the current state against the batch supertrend of the history
+    """
+
+    def __init__(self, n, m):
+        self.n = n
+        self.m = m
+        self.atr = StreamingATR(n)
+        self.value = np.nan
+        self.reversal = 0
+        self._rows = 0
+        self._started = False
+        self._close = np.nan
+        self._upper = np.nan
+        self._lower = np.nan
+
+    def __repr__(self):
+        return "StreamingSupertrend(n = {}, m = {}, value = {})".format(
+            self.n, self.m, self.value
+        )
+
+    def update(self, high, low, close):
+        """ Adds one closed candle and returns the supertrend.
+        """
+        width = self.m * self.atr.update(high, low, close)
+        upper = ((high + low) / 2) + width
+        lower = ((high + low) / 2) - width
+        prev_close, prev_upper, prev_lower = self._close, self._upper, self._lower
+        prev_value = self.value
+        value = np.nan
+        if self._rows >= self.n:
+            # same branches as _supertrend_pass
+            if prev_close <= prev_upper and prev_upper < upper:
+                upper = prev_upper
+            if prev_close >= prev_lower and prev_lower > lower:
+                lower = prev_lower
+            if not self._started:
+                if prev_close <= prev_upper and close > upper:
+                    value, self._started = lower, True
+                elif prev_close >= prev_lower and close < lower:
+                    value, self._started = upper, True
+            elif prev_value == prev_upper:
+                if close <= upper:
+                    value = upper
+                elif close >= upper:
+                    value = lower
+            elif prev_value == prev_lower:
+                if close >= lower:
+                    value = lower
+                elif close <= lower:
+                    value = upper
+        self.reversal = 0
+        if value < close and prev_value > prev_close:
+            self.reversal = 1
+        elif value > close and prev_value < prev_close:
+            self.reversal = -1
+        self._rows += 1
+        self._close, self._upper, self._lower = close, upper, lower
+        self.value = value
+        return value
+
+    def seed(self, DF):
+        """ Feeds the candles of a dataframe with high, low and close columns.
+        """
+        for high, low, close in DF[["high", "low", "close"]].to_numpy(dtype=float):
+            self.update(high, low, close)
+        return self.value
+
+    def verify(self, DF):
+        """ Returns whether the current supertrend and ATR equal the batch
+        calculation over DF, which must hold every candle fed so far.
+        """
+        if len(DF) != self._rows:
+            return False
+        batch = supertrend(DF, self.n, self.m).to_numpy()[-1]
+        batch_atr = atr(DF, self.n).to_numpy()[-1]
+        return bool(
+            np.array_equal(
+                [batch, batch_atr], [self.value, self.atr.value], equal_nan=True
+            )
+        )
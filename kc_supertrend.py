@@ -1,111 +1,55 @@
 import datetime as dt
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
-import numpy as np
 import pandas as pd
-from kiteconnect import KiteConnect
+
+from kiteconnect import KiteTicker
+
+from CandleBuilder import CandleBuilder
+from FinancialInstrument import HISTORICAL_LIMITER
+from indicators import StreamingSupertrend, supertrend_bank
+from InstrumentIndex import get_index
+from KiteSession import get_kite
+from RateLimiter import RateLimiter
+
+# shared by all ticker threads, Kite allows 10 order requests per second
+ORDER_LIMITER = RateLimiter(10)
 
 
 def get_access():
     cwd = os.path.join(os.getcwd(), "sensitive")
     instrument_df_loc = os.path.join(cwd, "nse_tickers.csv")
-    access_token = open(os.path.join(cwd, "access_token.txt"), "r").read()
-    key_secret = open(os.path.join(cwd, "api_key.txt"), "r").read().split()
-    kite = KiteConnect(api_key=key_secret[0])
-    kite.set_access_token(access_token)
-    instrument_df = pd.read_csv(instrument_df_loc)
-    kite = kite
-    instrument_df = instrument_df
-    return kite, instrument_df
+    kite = get_kite(cwd)
+    instrument_index = get_index(instrument_df_loc)
+    return kite, instrument_index
 
 
-kite, instrument_df = get_access()
+kite, instrument_index = get_access()
 
 
-def instrumentLookup(instrument_df, symbol):
+def instrumentLookup(instrument_index, symbol):
     """Looks up instrument token for a given script from instrument dump"""
-    try:
-        return instrument_df[
-            instrument_df.tradingsymbol == symbol
-        ].instrument_token.values[0]
-    except:
-        return -1
+    return instrument_index.lookup(symbol)
 
 
 def fetchOHLC(ticker, interval, duration):
     """extracts historical data and outputs in the form of dataframe"""
-    instrument = instrumentLookup(instrument_df, ticker)
-    data = pd.DataFrame(
-        kite.historical_data(
+    instrument = instrumentLookup(instrument_index, ticker)
+    with HISTORICAL_LIMITER:
+        candles = kite.historical_data(
             instrument,
             dt.date.today() - dt.timedelta(duration),
             dt.date.today(),
             interval,
         )
-    )
+    data = pd.DataFrame(candles)
     data.set_index("date", inplace=True)
     return data
 
 
-def atr(DF, n):
-    "function to calculate True Range and Average True Range"
-    df = DF.copy()
-    df["H-L"] = abs(df["high"] - df["low"])
-    df["H-PC"] = abs(df["high"] - df["close"].shift(1))
-    df["L-PC"] = abs(df["low"] - df["close"].shift(1))
-    df["TR"] = df[["H-L", "H-PC", "L-PC"]].max(axis=1, skipna=False)
-    df["ATR"] = df["TR"].ewm(com=n, min_periods=n).mean()
-    return df["ATR"]
-
-
-def supertrend(DF, n, m):
-    """function to calculate Supertrend given historical candle data
-        n = n day ATR - usually 7 day ATR is used
-        m = multiplier - usually 2 or 3 is used"""
-    df = DF.copy()
-    df["ATR"] = atr(df, n)
-    df["B-U"] = ((df["high"] + df["low"]) / 2) + m * df["ATR"]
-    df["B-L"] = ((df["high"] + df["low"]) / 2) - m * df["ATR"]
-    df["U-B"] = df["B-U"]
-    df["L-B"] = df["B-L"]
-    ind = df.index
-    for i in range(n, len(df)):
-        if df["close"][i - 1] <= df["U-B"][i - 1]:
-            df.loc[ind[i], "U-B"] = min(df["B-U"][i], df["U-B"][i - 1])
-        else:
-            df.loc[ind[i], "U-B"] = df["B-U"][i]
-    for i in range(n, len(df)):
-        if df["close"][i - 1] >= df["L-B"][i - 1]:
-            df.loc[ind[i], "L-B"] = max(df["B-L"][i], df["L-B"][i - 1])
-        else:
-            df.loc[ind[i], "L-B"] = df["B-L"][i]
-    df["Strend"] = np.nan
-    for test in range(n, len(df)):
-        if (
-            df["close"][test - 1] <= df["U-B"][test - 1]
-            and df["close"][test] > df["U-B"][test]
-        ):
-            df.loc[ind[test], "Strend"] = df["L-B"][test]
-            break
-        if (
-            df["close"][test - 1] >= df["L-B"][test - 1]
-            and df["close"][test] < df["L-B"][test]
-        ):
-            df.loc[ind[test], "Strend"] = df["U-B"][test]
-            break
-    for i in range(test + 1, len(df)):
-        if df["Strend"][i - 1] == df["U-B"][i - 1] and df["close"][i] <= df["U-B"][i]:
-            df.loc[ind[i], "Strend"] = df["U-B"][i]
-        elif df["Strend"][i - 1] == df["U-B"][i - 1] and df["close"][i] >= df["U-B"][i]:
-            df.loc[ind[i], "Strend"] = df["L-B"][i]
-        elif df["Strend"][i - 1] == df["L-B"][i - 1] and df["close"][i] >= df["L-B"][i]:
-            df.loc[ind[i], "Strend"] = df["L-B"][i]
-        elif df["Strend"][i - 1] == df["L-B"][i - 1] and df["close"][i] <= df["L-B"][i]:
-            df.loc[ind[i], "Strend"] = df["U-B"][i]
-    return df["Strend"]
-
-
 def st_dir_refresh(ohlc, ticker):
     """function to check for supertrend reversal"""
     global st_dir
@@ -145,6 +89,7 @@ def placeSLOrder(symbol, buy_sell, quantity, sl_price):
     elif buy_sell == "sell":
         t_type = kite.TRANSACTION_TYPE_SELL
         t_type_sl = kite.TRANSACTION_TYPE_BUY
+    ORDER_LIMITER.wait()
     kite.place_order(
         tradingsymbol=symbol,
         exchange=kite.EXCHANGE_NSE,
@@ -154,6 +99,7 @@ def placeSLOrder(symbol, buy_sell, quantity, sl_price):
         product=kite.PRODUCT_MIS,
         variety=kite.VARIETY_REGULAR,
     )
+    ORDER_LIMITER.wait()
     kite.place_order(
         tradingsymbol=symbol,
         exchange=kite.EXCHANGE_NSE,
@@ -169,6 +115,7 @@ def placeSLOrder(symbol, buy_sell, quantity, sl_price):
 
 def ModifyOrder(order_id, price):
     # Modify order given order id
+    ORDER_LIMITER.wait()
     kite.modify_order(
         order_id=order_id,
         price=price,
@@ -178,7 +125,59 @@ def ModifyOrder(order_id, price):
     )
 
 
-def main(capital):
+def trade_ticker(ticker, ohlc, capital, pos_df, ord_df):
+    """places or modifies the orders of one ticker given its candles with the
+    st1, st2, st3 supertrend columns and the refreshed st_dir"""
+    quantity = int(capital / ohlc["close"][-1])
+    if len(pos_df.columns) == 0:
+        if st_dir[ticker] == ["green", "green", "green"]:
+            placeSLOrder(ticker, "buy", quantity, sl_price(ohlc))
+        if st_dir[ticker] == ["red", "red", "red"]:
+            placeSLOrder(ticker, "sell", quantity, sl_price(ohlc))
+    if len(pos_df.columns) != 0 and ticker not in pos_df["tradingsymbol"].tolist():
+        if st_dir[ticker] == ["green", "green", "green"]:
+            placeSLOrder(ticker, "buy", quantity, sl_price(ohlc))
+        if st_dir[ticker] == ["red", "red", "red"]:
+            placeSLOrder(ticker, "sell", quantity, sl_price(ohlc))
+    if len(pos_df.columns) != 0 and ticker in pos_df["tradingsymbol"].tolist():
+        if pos_df[pos_df["tradingsymbol"] == ticker]["quantity"].values[0] == 0:
+            if st_dir[ticker] == ["green", "green", "green"]:
+                placeSLOrder(ticker, "buy", quantity, sl_price(ohlc))
+            if st_dir[ticker] == ["red", "red", "red"]:
+                placeSLOrder(ticker, "sell", quantity, sl_price(ohlc))
+        if pos_df[pos_df["tradingsymbol"] == ticker]["quantity"].values[0] != 0:
+            order_id = ord_df.loc[
+                (ord_df["tradingsymbol"] == ticker)
+                & (ord_df["status"].isin(["TRIGGER PENDING", "OPEN"]))
+            ]["order_id"].values[0]
+            ModifyOrder(order_id, sl_price(ohlc))
+
+
+def process_ticker(ticker, capital, pos_df, ord_df, deadline):
+    """fetches candles, refreshes supertrend directions and places or modifies
+    the orders of one ticker; orders are skipped once the cycle's deadline
+    (a time.monotonic() value) has passed, as the candles are stale by then"""
+    print("starting passthrough for.....", ticker)
+    try:
+        ohlc = fetchOHLC(ticker, "5minute", 4)
+        strend, _ = supertrend_bank(
+            ohlc["high"], ohlc["low"], ohlc["close"], st_configs
+        )
+        for k in range(len(st_configs)):
+            ohlc["st{}".format(k + 1)] = strend[:, k, 0]
+        st_dir_refresh(ohlc, ticker)
+        if time.monotonic() > deadline:
+            print("deadline passed, skipping orders for ticker :", ticker)
+            return
+        trade_ticker(ticker, ohlc, capital, pos_df, ord_df)
+    except:
+        print("API error for ticker :", ticker)
+
+
+def fetch_book():
+    """extracts the day's positions and the orders, retrying up to 10 times;
+    returns None for a book that could not be extracted"""
+    pos_df, ord_df = None, None
     a, b = 0, 0
     while a < 10:
         try:
@@ -194,43 +193,102 @@ def main(capital):
         except:
             print("can't extract order data..retrying")
             b += 1
+    return pos_df, ord_df
+
 
+def main(capital, max_workers=8, ticker_timeout=60, cycle_timeout=240):
+    global ticker_pool
+    pos_df, ord_df = fetch_book()
+    if pos_df is None or ord_df is None:
+        print("can't extract positions or orders, skipping this cycle")
+        return
+
+    # every ticker runs in its own thread, Kite calls are spaced by the limiters
+    if ticker_pool is None:
+        ticker_pool = ThreadPoolExecutor(max_workers=max_workers)
+    deadline = time.monotonic() + ticker_timeout
     for ticker in tickers:
-        print("starting passthrough for.....", ticker)
-        try:
-            ohlc = fetchOHLC(ticker, "5minute", 4)
-            ohlc["st1"] = supertrend(ohlc, 7, 3)
-            ohlc["st2"] = supertrend(ohlc, 10, 3)
-            ohlc["st3"] = supertrend(ohlc, 11, 2)
-            st_dir_refresh(ohlc, ticker)
-            quantity = int(capital / ohlc["close"][-1])
-            if len(pos_df.columns) == 0:
-                if st_dir[ticker] == ["green", "green", "green"]:
-                    placeSLOrder(ticker, "buy", quantity, sl_price(ohlc))
-                if st_dir[ticker] == ["red", "red", "red"]:
-                    placeSLOrder(ticker, "sell", quantity, sl_price(ohlc))
-            if (
-                len(pos_df.columns) != 0
-                and ticker not in pos_df["tradingsymbol"].tolist()
-            ):
-                if st_dir[ticker] == ["green", "green", "green"]:
-                    placeSLOrder(ticker, "buy", quantity, sl_price(ohlc))
-                if st_dir[ticker] == ["red", "red", "red"]:
-                    placeSLOrder(ticker, "sell", quantity, sl_price(ohlc))
-            if len(pos_df.columns) != 0 and ticker in pos_df["tradingsymbol"].tolist():
-                if pos_df[pos_df["tradingsymbol"] == ticker]["quantity"].values[0] == 0:
-                    if st_dir[ticker] == ["green", "green", "green"]:
-                        placeSLOrder(ticker, "buy", quantity, sl_price(ohlc))
-                    if st_dir[ticker] == ["red", "red", "red"]:
-                        placeSLOrder(ticker, "sell", quantity, sl_price(ohlc))
-                if pos_df[pos_df["tradingsymbol"] == ticker]["quantity"].values[0] != 0:
-                    order_id = ord_df.loc[
-                        (ord_df["tradingsymbol"] == ticker)
-                        & (ord_df["status"].isin(["TRIGGER PENDING", "OPEN"]))
-                    ]["order_id"].values[0]
-                    ModifyOrder(order_id, sl_price(ohlc))
-        except:
-            print("API error for ticker :", ticker)
+        # an overrunning passthrough must not race a new one on the same ticker
+        if ticker in running and not running[ticker].done():
+            print("previous passthrough still running for ticker :", ticker)
+            continue
+        running[ticker] = ticker_pool.submit(
+            process_ticker, ticker, capital, pos_df, ord_df, deadline
+        )
+    _, not_done = wait(list(running.values()), timeout=cycle_timeout)
+    for ticker, future in running.items():
+        if future in not_done:
+            print("ticker still running at the end of the cycle :", ticker)
+
+
+def fetch_candle_book(start):
+    """fetches the positions and orders once per candle boundary: every ticker
+    closing the candle that started at start trades against the same book"""
+    with book_lock:
+        if start not in candle_book:
+            candle_book.clear()
+            candle_book[start] = fetch_book()
+        return candle_book[start]
+
+
+def process_candle(ticker, candle, capital):
+    """updates the streaming supertrends of a ticker with a closed candle,
+    refreshes its supertrend directions and trades on it"""
+    row = {"close": candle["close"]}
+    for k, stream in enumerate(st_streams[ticker]):
+        row["st{}".format(k + 1)] = stream.update(
+            candle["high"], candle["low"], candle["close"]
+        )
+        if stream.reversal == 1:
+            st_dir[ticker][k] = "green"
+        elif stream.reversal == -1:
+            st_dir[ticker][k] = "red"
+    ohlc = pd.DataFrame([row], index=pd.DatetimeIndex([candle.name]))
+    pos_df, ord_df = fetch_candle_book(candle.name)
+    if pos_df is None or ord_df is None:
+        print("no positions/orders for candle", candle.name, "skipping", ticker)
+        return
+    try:
+        trade_ticker(ticker, ohlc, capital, pos_df, ord_df)
+    except:
+        print("API error for ticker :", ticker)
+
+
+def run_live(capital, feed=None):
+    """trades on 5 minute candles built from the websocket tick stream instead
+    of polling historical data; feed defaults to a KiteTicker connection, pass
+    a CandleBuilder.ReplayTicker to replay recorded ticks offline. Returns the
+    CandleBuilder, whose flush should be called regularly to close the candles
+    of tickers that stopped ticking"""
+    tokens = {instrumentLookup(instrument_index, ticker): ticker for ticker in tickers}
+    # one thread per ticker: its candles are processed one at a time, in order
+    workers = {ticker: ThreadPoolExecutor(max_workers=1) for ticker in tickers}
+
+    def on_close(token, candle):
+        # keep the websocket thread free, orders go through the ticker's worker
+        ticker = tokens[token]
+        workers[ticker].submit(process_candle, ticker, candle, capital)
+
+    builder = CandleBuilder("5minute", on_close=on_close)
+    for token, ticker in tokens.items():
+        # the last historical candle is still forming, the ticks complete it
+        history = fetchOHLC(ticker, "5minute", 4).iloc[:-1]
+        builder.seed(token, history)
+        st_streams[ticker] = [StreamingSupertrend(n, m) for n, m in st_configs]
+        for stream in st_streams[ticker]:
+            stream.seed(history)
+
+    if feed is None:
+        feed = KiteTicker(kite.api_key, kite.access_token)
+
+    def on_connect(ws, response):
+        ws.subscribe(list(tokens))
+        ws.set_mode(ws.MODE_FULL, list(tokens))
+
+    feed.on_ticks = builder.on_ticks
+    feed.on_connect = on_connect
+    feed.connect(threaded=True)
+    return builder
 
 
 #############################################################################################################
@@ -252,16 +310,29 @@ tickers = [
 ]
 # tickers to track - recommended to use max movers from previous day
 capital = 3000  # position size
+st_configs = [(7, 3), (10, 3), (11, 2)]  # (ATR period, multiplier) of st1, st2, st3
 st_dir = {}  # directory to store super trend status for each ticker
+st_streams = {}  # streaming supertrends of each ticker (live mode)
+ticker_pool = None  # threads running the per-ticker passthroughs
+running = {}  # latest passthrough future of each ticker
+candle_book = {}  # positions and orders of the last closed candle (live mode)
+book_lock = threading.Lock()
+live = False  # trade on websocket candles instead of polling every 5 minutes
 for ticker in tickers:
     st_dir[ticker] = ["None", "None", "None"]
 
 starttime = time.time()
 timeout = time.time() + 60 * 60 * 1  # 60 seconds times 360 meaning 6 hrs
+if live:
+    builder = run_live(capital)
 while time.time() <= timeout:
     try:
-        main(capital)
-        time.sleep(300 - ((time.time() - starttime) % 300.0))
+        if live:
+            builder.flush()
+            time.sleep(1)
+        else:
+            main(capital)
+            time.sleep(300 - ((time.time() - starttime) % 300.0))
     except KeyboardInterrupt:
         print("\n\nKeyboard exception received. Exiting.")
         exit()
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+def kept_rows(*columns):
+    """ Returns the rows DataFrame.dropna() would keep for the given columns.
+
+    A slice (no copy when indexing) is returned when the missing values only
+    precede the first complete row, which is what rolling indicators produce.
+    """
+    valid = np.ones(len(columns[0]), dtype=bool)
+    for column in columns:
+        valid &= ~np.isnan(column)
+    first = int(valid.argmax()) if valid.any() else len(valid)
+    if valid[first:].all():
+        return slice(first, None)
+    return valid
+
+
+def strategy_returns(position, returns, tc=0.0, carried=False):
+    """ Per-row strategy returns and trades of holding position[k] over the
+    return of row k + 1, along the last axis (one row shorter than the input).
+
+    Mirrors the rich test_strategy pipelines: the first row only sets the
+    position, trades are the absolute position changes from the second row on
+    and every unit traded costs tc. With carried, the first row's position was
+    already held (e.g. from an earlier walk-forward window), so changing it on
+    the second row is traded as well.
+    """
+    trades = np.zeros(position.shape[:-1] + (max(position.shape[-1] - 1, 0),))
+    first = 0 if carried else 1
+    trades[..., first:] = np.abs(np.diff(position[..., first:], axis=-1))
+    strategy = position[..., :-1] * returns[..., 1:] - trades * tc
+    return strategy, trades
+
+
+def strategy_metrics(position, returns, tc=0.0):
+    """ Performance of holding position[k] over the return of row k + 1.
+
+    Works along the last axis, so a batch of position series can be
+    evaluated at once (see strategy_returns).
+
+    Returns
+    =======
+    perf, outperf, trades: absolute performance, outperformance against buy
+    and hold, and number of units traded
+    """
+    strategy, trades = strategy_returns(position, returns, tc)
+    perf = np.exp(strategy.sum(axis=-1))
+    outperf = perf - np.exp(returns[..., 1:].sum(axis=-1))
+    return perf, outperf, trades.sum(axis=-1)
+
+
+def cost_curves(strategy, trades, tcs):
+    """ Cumulative net log returns of one strategy for many cost levels at once.
+
+    The gross strategy returns and trades do not depend on the cost, so the
+    net curves are the cumulative gross returns minus the outer product of
+    the cumulative trades and the costs.
+
+    Returns
+    =======
+    np.ndarray
+        (rows x costs) cumulative log returns net of costs
+    """
+    tcs = np.asarray(tcs, dtype=float)
+    return np.cumsum(strategy)[:, None] - np.outer(np.cumsum(trades), tcs)
+
+
+def breakeven_tc(strategy, trades, benchmark=0.0):
+    """ Cost per unit traded at which the total log return of the strategy
+    falls to `benchmark` (0 to break even, the buy and hold log return to
+    match buy and hold); inf when nothing is traded.
+    """
+    units = np.sum(trades)
+    if units == 0:
+        return np.inf
+    return (np.sum(strategy) - benchmark) / units
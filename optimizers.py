@@ -0,0 +1,169 @@
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+from scipy.optimize import brute
+
+
+class Optimizer(ABC):
+    """ Interface of the parameter optimizers used by the backtesters.
+
+    An optimizer minimizes func over parameter ranges given as tuples of the
+    form (start, end, step size), the same ranges scipy's brute takes.
+
+    Methods
+    =======
+    minimize:
+        returns the best parameters found and the function value there
+    """
+
+    @abstractmethod
+    def minimize(self, func, ranges, integer=None):
+        """ Returns (x, func(x)) for the best point found.
+
+        Parameters
+        ==========
+        func: callable
+            objective taking a parameter array
+        ranges: tuple
+            tuples of the form (start, end, step size)
+        integer: tuple of bool, optional
+            which parameters only take values on their grid (default all)
+        """
+
+
+class BruteOptimizer(Optimizer):
+    """ Exhaustive grid search with scipy's brute (end of each range excluded).
+    """
+
+    def __repr__(self):
+        return "BruteOptimizer()"
+
+    def minimize(self, func, ranges, integer=None):
+        x, fx, _, _ = brute(func, ranges, full_output=True, finish=None)
+        return np.atleast_1d(x), fx
+
+
+class PatternSearchOptimizer(Optimizer):
+    """ Multi-start compass (pattern) search with an evaluation or time budget.
+
+    From each start point the search probes one step up and down along every
+    parameter, moves to any improvement and halves the step once no probe
+    improves, until the step reaches the grid step (integer parameters) or
+    `resolution` times the grid step (continuous parameters). The first start
+    is the centre of the ranges, further starts are drawn at random while the
+    budget lasts (or up to n_starts) until one evaluates no new point. Points
+    already evaluated are never evaluated again.
+
+    Attributes
+    ==========
+    max_evals: int
+        maximum number of objective evaluations (None for no limit)
+    max_time: float
+        maximum search time in seconds (None for no limit)
+    n_starts: int
+        maximum number of start points (None to restart until the budget is spent)
+    resolution: float
+        finest step of continuous parameters as a fraction of their grid step
+    seed: int
+        seed of the random start points
+    n_evals: int
+        number of evaluations used by the last search
+    """
+
+    def __init__(
+        self, max_evals=200, max_time=None, n_starts=None, resolution=0.1, seed=0
+    ):
+        self.max_evals = max_evals
+        self.max_time = max_time
+        self.n_starts = n_starts
+        self.resolution = resolution
+        self.seed = seed
+        self.n_evals = 0
+
+    def __repr__(self):
+        rep = "PatternSearchOptimizer(max_evals = {}, max_time = {}, n_starts = {})"
+        return rep.format(self.max_evals, self.max_time, self.n_starts)
+
+    def minimize(self, func, ranges, integer=None):
+        start, end, step = np.array(ranges, dtype=float).T
+        if integer is None:
+            integer = np.ones(len(ranges), dtype=bool)
+        integer = np.asarray(integer, dtype=bool)
+        # integer parameters live on the brute grid, continuous ones anywhere
+        low = start
+        last = start + np.ceil((end - start) / step - 1) * step
+        high = np.where(integer, last, end)
+        min_step = np.where(integer, step, step * self.resolution)
+
+        def snap(x):
+            x = np.clip(x, low, high)
+            return np.where(integer, low + np.round((x - low) / step) * step, x)
+
+        evaluated = {}
+        deadline = None
+        if self.max_time is not None:
+            deadline = time.monotonic() + self.max_time
+
+        def budget_left():
+            if self.max_evals is not None and len(evaluated) >= self.max_evals:
+                return False
+            return deadline is None or time.monotonic() < deadline
+
+        def evaluate(x):
+            key = tuple(np.round(x, 10))
+            if key not in evaluated:
+                evaluated[key] = func(x)
+            return evaluated[key]
+
+        rng = np.random.default_rng(self.seed)
+        n_starts = self.n_starts
+        if n_starts is None and self.max_evals is None and self.max_time is None:
+            n_starts = 4
+        x = snap((low + high) / 2)
+        starts = 0
+        while budget_left() and (n_starts is None or starts < n_starts):
+            if starts:
+                x = snap(rng.uniform(low, high))
+            starts += 1
+            n_before = len(evaluated)
+            fx = evaluate(x)
+            mesh = np.maximum((high - low) / 4, min_step)
+            while budget_left():
+                improved = False
+                for d in range(len(x)):
+                    for sign in (1, -1):
+                        if not budget_left():
+                            break
+                        candidate = x.copy()
+                        candidate[d] += sign * mesh[d]
+                        candidate = snap(candidate)
+                        if np.array_equal(candidate, x):
+                            continue
+                        fc = evaluate(candidate)
+                        if fc < fx:
+                            x, fx, improved = candidate, fc, True
+                if not improved:
+                    if np.all(mesh <= min_step):
+                        break
+                    mesh = np.maximum(mesh / 2, min_step)
+            if len(evaluated) == n_before:
+                # this start and all its probes were evaluated before: stop
+                # restarting (the grid need not be exhausted)
+                break
+
+        self.n_evals = len(evaluated)
+        best = min(evaluated, key=evaluated.get)
+        return np.array(best), evaluated[best]
+
+
+def get_optimizer(method):
+    """ Returns the optimizer for a method name ("brute", "pattern") or instance.
+    """
+    if isinstance(method, Optimizer):
+        return method
+    if method == "brute":
+        return BruteOptimizer()
+    if method == "pattern":
+        return PatternSearchOptimizer()
+    raise ValueError("unknown optimization method {}".format(method))
@@ -0,0 +1,202 @@
+import numpy as np
+
+
+class RollingStats:
+    """ Rolling means and standard deviations of one series for any window.
+
+    Running sums of the values and of their squares are built once; the mean
+    and standard deviation for a window are then two differences of those
+    sums and are cached, so sweeping many windows (or re-visiting a window
+    during an optimization) never repeats a rolling pass. Values are centred
+    on their mean before summing, which keeps the sums small, but on a long
+    trending series the running sums still dwarf a small window's mean and
+    variance. Wherever the rounding error of the sums could matter, the mean
+    or variance is recomputed from sums over the surrounding stretch of rows
+    only (or, failing that, from the window itself), and windows of equal
+    values have a variance of exactly 0.
+
+    Like pandas' rolling(window).mean() / .std(), a statistic is NaN unless
+    its window holds `window` valid observations, and std uses ddof=1.
+
+    Attributes
+    ==========
+    values: np.ndarray
+        1-d series or 2-d (time x symbols) panel, windows run along axis 0
+
+    Methods
+    =======
+    mean, std:
+        rolling mean / standard deviation for one window
+
+    means, stds:
+        stacked rolling means / standard deviations for many windows
+
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(self.values)
+        count = valid.sum(axis=0)
+        self._shift = np.where(
+            count > 0, np.nansum(self.values, axis=0) / np.maximum(count, 1), 0.0
+        )
+        centred = np.where(valid, self.values - self._shift, 0.0)
+        # extended precision (where the platform has it) for the running sums
+        zeros = np.zeros((1,) + self.values.shape[1:], dtype=np.longdouble)
+        self._sum = np.concatenate(
+            [zeros, np.cumsum(centred, axis=0, dtype=np.longdouble)]
+        )
+        self._sum_sq = np.concatenate(
+            [zeros, np.cumsum(centred.astype(np.longdouble) ** 2, axis=0)]
+        )
+        self._count = np.concatenate([zeros.astype(int), np.cumsum(valid, axis=0)])
+        # magnitudes of the running sums, bounding their rounding errors
+        self._size = abs(self._sum).astype(float)
+        self._size_sq = self._sum_sq.astype(float)
+        # a running sum's error is bounded by the sum of the running sums so far
+        self._drift = np.cumsum(self._size, axis=0)
+        # running count of values equal to their predecessor, for flat windows
+        same = self.values[1:] == self.values[:-1]
+        self._same = np.concatenate([zeros.astype(int), np.cumsum(same, axis=0)])
+        self._means = {}
+        self._stds = {}
+
+    def __repr__(self):
+        return "RollingStats(shape = {}, cached windows = {})".format(
+            self.values.shape, len(self._means)
+        )
+
+    def _window_sums(self, window):
+        total = self._sum[window:] - self._sum[:-window]
+        total_sq = self._sum_sq[window:] - self._sum_sq[:-window]
+        complete = (self._count[window:] - self._count[:-window]) == window
+        return total, total_sq, complete
+
+    def _empty(self):
+        return np.full(self.values.shape, np.nan)
+
+    def mean(self, window):
+        """ Rolling mean for one window.
+        """
+        window = int(window)
+        if window not in self._means:
+            mean = self._empty()
+            if 1 <= window <= len(self.values):
+                total, _, complete = self._window_sums(window)
+                means = (total / window).astype(float) + self._shift
+                error = self._mean_rounding(window, self._drift, self._shift)
+                # less than ~12 significant digits left: recompute from sums
+                # over the surrounding rows, then from the windows themselves
+                inexact = complete & (error > 1e-12 * abs(means))
+                if inexact.any():
+                    local, error, _, _ = self._local_sums(window, inexact)
+                    means[inexact] = local
+                    inexact[inexact] = error > 1e-12 * abs(local)
+                if inexact.any():
+                    means[inexact] = self._window_moments(window, inexact)[0]
+                mean[window - 1 :] = np.where(complete, means, np.nan)
+            self._means[window] = mean
+        return self._means[window]
+
+    def std(self, window):
+        """ Rolling standard deviation (ddof=1) for one window.
+        """
+        window = int(window)
+        if window not in self._stds:
+            std = self._empty()
+            if 2 <= window <= len(self.values):
+                total, total_sq, complete = self._window_sums(window)
+                squares = (total_sq - total ** 2 / window).astype(float)
+                error = self._rounding(window, self._size, self._size_sq, total)
+                flat = (self._same[window - 1 :] - self._same[: 1 - window]) == window - 1
+                # less than ~8 significant digits left: recompute from sums
+                # over the surrounding rows, then from the windows themselves
+                inexact = complete & ~flat & (squares <= 1e8 * error)
+                if inexact.any():
+                    _, _, local, error = self._local_sums(window, inexact)
+                    squares[inexact] = local
+                    inexact[inexact] = local <= 1e8 * error
+                if inexact.any():
+                    squares[inexact] = self._window_moments(window, inexact)[1]
+                squares[flat] = 0.0
+                var = squares / (window - 1)
+                std[window - 1 :] = np.where(
+                    complete, np.sqrt(np.maximum(var, 0.0)), np.nan
+                )
+            self._stds[window] = std
+        return self._stds[window]
+
+    @staticmethod
+    def _rounding(window, size, size_sq, total, dtype=np.longdouble):
+        # a window's sums carry the rounding of `window` running-sum steps,
+        # relative to the magnitude of the running sums
+        return np.finfo(dtype).eps * (
+            window * size_sq[window:]
+            + 2 * abs(total.astype(float)) * (size[window:] + size[:-window])
+        )
+
+    @staticmethod
+    def _mean_rounding(window, drift, shift, dtype=np.longdouble):
+        # the rounding accumulated by both running sums, plus that of adding
+        # the shift back to a mean much smaller than it
+        return (
+            np.finfo(dtype).eps * (drift[window:] + drift[:-window]) / window
+            + np.finfo(float).eps * abs(shift)
+        )
+
+    def _local_sums(self, window, rows):
+        """ Means and sums of squared deviations from the mean of the windows
+        ending at the masked rows, each with its rounding error, from running
+        sums over short stretches of the series centred on their own mean.
+        """
+        means, mean_error = np.zeros(rows.shape), np.zeros(rows.shape)
+        squares, error = np.zeros(rows.shape), np.zeros(rows.shape)
+        columns = rows.reshape(len(rows), -1)
+        values = self.values.reshape(len(self.values), -1)
+        block = max(window, 1024)
+        for column in range(columns.shape[1]):
+            blocks = np.unique(np.nonzero(columns[:, column])[0] // block)
+            for start in blocks * block:
+                stop = min(start + block, len(columns))
+                stretch = values[start : stop + window - 1, column]
+                valid = ~np.isnan(stretch)
+                shift = stretch[valid].mean()
+                centred = np.where(valid, stretch - shift, 0.0)
+                centred = np.concatenate([[0.0], centred])
+                sums, sums_sq = np.cumsum(centred), np.cumsum(centred ** 2)
+                total = sums[window:] - sums[:-window]
+                total_sq = sums_sq[window:] - sums_sq[:-window]
+                at = (slice(start, stop),) + np.unravel_index(column, rows.shape[1:])
+                means[at] = total / window + shift
+                drift = np.cumsum(abs(sums))
+                mean_error[at] = self._mean_rounding(window, drift, shift, float)
+                squares[at] = total_sq - total ** 2 / window
+                error[at] = self._rounding(window, abs(sums), sums_sq, total, float)
+        return means[rows], mean_error[rows], squares[rows], error[rows]
+
+    def _window_moments(self, window, rows):
+        """ Means and sums of squared deviations from the mean, computed
+        directly for the windows ending at the masked rows.
+        """
+        views = np.lib.stride_tricks.sliding_window_view(self.values, window, axis=0)
+        rows = np.nonzero(rows)
+        means, squares = np.empty(len(rows[0])), np.empty(len(rows[0]))
+        # a bounded number of windows is copied at a time
+        step = max(1, 2 ** 20 // window)
+        for start in range(0, len(squares), step):
+            chunk = slice(start, start + step)
+            windows = views[tuple(index[chunk] for index in rows)]
+            means[chunk] = windows.mean(axis=-1)
+            deviations = windows - means[chunk][:, None]
+            squares[chunk] = (deviations ** 2).sum(axis=-1)
+        return means, squares
+
+    def means(self, windows):
+        """ Rolling means stacked as (len(windows),) + values.shape.
+        """
+        return np.stack([self.mean(window) for window in windows])
+
+    def stds(self, windows):
+        """ Rolling standard deviations stacked as (len(windows),) + values.shape.
+        """
+        return np.stack([self.std(window) for window in windows])
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def walk_forward_splits(n, train, test):
+    """ Returns the (train start, test start, test end) rows of consecutive
+    walk-forward splits over n rows, sliding by `test` rows each time.
+    """
+    splits = []
+    lo = 0
+    while lo + train < n:
+        splits.append((lo, lo + train, min(lo + train + test, n)))
+        lo += test
+    return splits
+
+
+def walk_forward(data, train, test, optimize, run, max_workers=None):
+    """ Walk-forward optimization over the rows of a backtester's data.
+
+    Every train window is optimized (concurrently, the optimizers work on
+    numpy arrays), the winning parameters are run on the test window that
+    follows and the test windows are stitched into one out-of-sample curve.
+
+    Parameters
+    ==========
+    data: pd.DataFrame
+        backtester data with a "returns" column
+    train, test: int
+        number of rows in each train and test window
+    optimize: callable
+        optimize(lo, hi) -> (parameters, in-sample performance) on rows [lo, hi)
+    run: callable
+        run(parameters, lo, hi, held) -> (strategy log returns of rows [lo, hi),
+        position held on row hi - 1), where held is the position held on row
+        lo - 1 by the previous split (None for the first split)
+    max_workers: int
+        number of train windows optimized at the same time
+
+    Returns
+    =======
+    splits: pd.DataFrame
+        dates, parameters and in-/out-of-sample performance of every split
+    results: pd.DataFrame
+        stitched out-of-sample returns, strategy and cumulative curves
+    """
+    splits = walk_forward_splits(len(data), train, test)
+    if not splits:
+        raise ValueError("not enough data for a single train window")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        optimized = list(pool.map(lambda split: optimize(*split[:2]), splits))
+
+    rows, strategy, held = [], [], None
+    for (lo, mid, hi), (params, in_sample) in zip(splits, optimized):
+        # the position carries over between test windows, so a change of
+        # position at a split boundary is traded like any other
+        oos, held = run(params, mid, hi, held)
+        strategy.append(oos)
+        rows.append(
+            {
+                "train_start": data.index[lo],
+                "train_end": data.index[mid - 1],
+                "test_start": data.index[mid],
+                "test_end": data.index[hi - 1],
+                "params": tuple(params),
+                "in_sample_perf": round(in_sample, 6),
+                "out_of_sample_perf": round(np.exp(oos.sum()), 6),
+            }
+        )
+
+    first, last = splits[0][1], splits[-1][2]
+    results = data[["returns"]].iloc[first:last].copy()
+    results["strategy"] = np.concatenate(strategy)
+    results["creturns"] = results["returns"].cumsum().apply(np.exp)
+    results["cstrategy"] = results["strategy"].cumsum().apply(np.exp)
+    return pd.DataFrame(rows), results